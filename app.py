@@ -1,16 +1,9 @@
 import os
 import sys
-import csv
 import datetime
 from multiprocessing import freeze_support
-from typing import List
-from contextlib import ExitStack
 
-import dask
-import dask.bag as db
-import pandas as pd
-
-from PySide6.QtCore import QSettings, QSize, Qt, QStandardPaths, QObject, QThread, Signal, Slot, QThreadPool
+from PySide6.QtCore import QSettings, QSize, Qt, QStandardPaths, QObject, QThread, Signal, Slot, QThreadPool, QTimer
 from PySide6.QtGui import QRegularExpressionValidator, QFont, QIcon, QIntValidator
 from PySide6.QtWidgets import (
     QApplication,
@@ -29,6 +22,9 @@ from PySide6.QtWidgets import (
 )
 
 from constants import CONSTANTS
+from coefficients import building_index, calculate_dynamic, calculate_e1, calculate_zet, sweep_scenarios
+from profiling import profiled, write_report
+from progress import Cancelled, Job
 
 
 basedir = os.path.dirname(__file__)
@@ -40,7 +36,7 @@ try:
 except ImportError:
     pass
 
-version = '0.0.1'
+version = CONSTANTS.VERSION
 
 combobox_style = '''
     QComboBox {
@@ -66,9 +62,10 @@ save_dir = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.Docum
 
 class PulsWorker(QObject):
     finished = Signal()
+    progress = Signal(str)
     time = Signal(str)
 
-    def __init__(self, files, height_building, width_building, index, dynamic, coef_corr, area_data):
+    def __init__(self, files, height_building, width_building, index, dynamic, coef_corr, area_data, backend, scenarios=None, snapshots=False):
         super().__init__()
         self.files = files
         self.height_building = height_building
@@ -77,41 +74,46 @@ class PulsWorker(QObject):
         self.dynamic = dynamic
         self.puls_coef_corr = coef_corr
         self.area_data = area_data
+        self.backend = backend
+        self.scenarios = scenarios
+        self.snapshots = snapshots
+        self.job = Job(backend, self.progress.emit)
 
     @Slot()
     def run(self):
-        threadCount = QThreadPool.globalInstance().maxThreadCount()
-        start = datetime.datetime.now()
-        delayed_tasks = [dask.delayed(process_file_puls)(file, self.height_building, self.width_building, self.index, self.dynamic, self.puls_coef_corr, self.area_data) for file in self.files]
-        dask.compute(*delayed_tasks, scheduler='threads', num_workers=threadCount)
-        time = datetime.datetime.now() - start
-        self.finished.emit()
-        self.time.emit(str(time))
-
-
-class SortWorker(QObject):
-    finished = Signal()
-    progress = Signal(str)
-
-    def __init__(self, files):
-        super().__init__()
-        self.files = files
+        # numpy and the calculation modules are loaded by the first calculation, not at startup
+        from calculations import process_files_puls, process_files_sweep, process_snapshots, snapshot_statistics, statistic_values, write_statistics
 
-    @Slot()
-    def run(self):
-        self.progress.emit('Идёт сортировка и обработка данных ...')
         threadCount = QThreadPool.globalInstance().maxThreadCount()
-        delayed_tasks = [dask.delayed(sort_files)(file) for file in self.files]
-        dask.compute(*delayed_tasks, scheduler='threads', num_workers=threadCount)
-        self.progress.emit('Обработка выполнена')
-        self.finished.emit()
+        start = datetime.datetime.now()
+        self.job.connect()
+        try:
+            if self.snapshots and not self.scenarios:
+                process_snapshots(self.files, self.height_building, self.width_building, self.index, self.dynamic, self.puls_coef_corr, None, self.area_data, save_dir, self.backend, threadCount, job=self.job)
+            elif self.snapshots:
+                # the scenarios are calculated from the mean of the snapshots, written next to the results
+                stats, mesh = snapshot_statistics(self.files, self.backend, threadCount, job=self.job)
+                statistics = write_statistics(statistic_values(stats), mesh.xyz, save_dir)
+                process_files_sweep([statistics['mean']], self.height_building, self.width_building, self.index, self.scenarios, self.puls_coef_corr, save_dir, self.backend, threadCount, job=self.job)
+            elif self.scenarios:
+                process_files_sweep(self.files, self.height_building, self.width_building, self.index, self.scenarios, self.puls_coef_corr, save_dir, self.backend, threadCount, job=self.job)
+            else:
+                process_files_puls(self.files, self.height_building, self.width_building, self.index, self.dynamic, self.puls_coef_corr, self.area_data, save_dir, self.backend, threadCount, job=self.job)
+        except Cancelled:
+            self.progress.emit('Отменено')
+        else:
+            time = datetime.datetime.now() - start
+            self.time.emit(f'{str(time).split(".")[0]}; {self.job.summary()}')
+        finally:
+            write_report(self.job, 'sweep' if self.scenarios else 'puls', {'files': self.files, 'snapshots': self.snapshots, 'scenarios': [name for name, _, _ in self.scenarios or []], 'height': self.height_building, 'width': self.width_building, 'dynamic': self.dynamic, 'coef_corr': self.puls_coef_corr, 'backend': self.backend, 'workers': threadCount})
+            self.finished.emit()
 
 
 class PikWorker(QObject):
     finished = Signal()
     progress = Signal(str)
 
-    def __init__(self, files, height_building, width_building, index, coef_corr, area_data):
+    def __init__(self, files, height_building, width_building, index, coef_corr, area_data, join, backend, snapshots=False, epochs=0):
         super().__init__()
         self.files = files
         self.height_building = height_building
@@ -119,61 +121,46 @@ class PikWorker(QObject):
         self.index = index
         self.pik_coef_corr = coef_corr
         self.area_data = area_data
+        self.join = join
+        self.backend = backend
+        self.snapshots = snapshots
+        self.epochs = epochs
+        # only the sorting mode and the snapshots run worker tasks, the coordinate mode reports from this thread
+        self.job = Job(backend if join == 'sorted' or snapshots else 'threads', self.progress.emit)
 
     @Slot()
     def run(self):
+        if self.job.cancelled:
+            self.progress.emit('Отменено')
+            self.finished.emit()
+            return
+
         self.progress.emit('Идут вычисления ...')
-        if 'max' in self.files[0]:
-            processing_type = 'max'
-        elif 'min' in self.files[0]:
-            processing_type = 'min'
-
-        new_lines = []
-        with ExitStack() as stack:
-            files = [stack.enter_context(open(i, 'r')) for i in self.files]
-            for n, row in enumerate(zip(*files)):
-                if n != 0:
-                    # print('---', n, row)
-                    row = [list(map(lambda x: float(x), i.split())) for i in row]
-                    # print(row)
-                    match processing_type:
-                        case 'max':
-                            new_line = max(row, key=lambda x: x[0])
-                        case 'min':
-                            new_line = min(row, key=lambda x: x[0])
-                    new_lines.append(new_line)
-
-        alfa = self.area_data[0]
-        dzeta10 = self.area_data[2]
-        dimension = self.height_building - self.width_building
-        for line in new_lines:
-            pressure, Z = line[0], line[3]
-            match self.index:
-                case 1:
-                    result = pressure * (1 + dzeta10 * pow(self.height_building / 10, -alfa)) * self.pik_coef_corr
-                case 2:
-                    if Z >= dimension:
-                        result = pressure * (1 + dzeta10 * pow(self.height_building / 10, -alfa)) * self.pik_coef_corr
-                    else:
-                        result = pressure * (1 + dzeta10 * pow(self.width_building / 10, -alfa)) * self.pik_coef_corr
-                case 3:
-                    if Z >= dimension:
-                        result = pressure * (1 + dzeta10 * pow(self.height_building / 10, -alfa)) * self.pik_coef_corr
-                    else:
-                        if Z <= self.width_building:
-                            result = pressure * (1 + dzeta10 * pow(self.width_building / 10, -alfa)) * self.pik_coef_corr
-                        else:
-                            result = pressure * (1 + dzeta10 * pow(Z / 10, -alfa)) * self.pik_coef_corr
-            line[0] = result
-
-        file_name = f'{save_dir}\{processing_type}.csv'
-        with open(file_name, 'w', newline='') as f:
-            writer = csv.writer(f, delimiter='\t')
-            writer.writerow([f'{processing_type.capitalize()}', 'X(m)', 'Y(m)', 'Z(m)'])
-            writer.writerows(new_lines)
-
-        self.progress.emit('Завершено')
-        self.finished.emit()
+        from calculations import detect_processing_type, envelope_files_keyed, envelope_files_sorted, process_snapshots
+
+        threadCount = QThreadPool.globalInstance().maxThreadCount()
+        self.job.connect()
+        missing = 0
+        try:
+            # both peaks come out of the snapshots, max.csv and min.csv
+            match 'snapshots' if self.snapshots else self.join:
+                case 'snapshots':
+                    process_snapshots(self.files, self.height_building, self.width_building, self.index, None, None, self.pik_coef_corr, self.area_data, save_dir, self.backend, threadCount, epochs=self.epochs, job=self.job)
+                case 'sorted':
+                    envelope_files_sorted(self.files, detect_processing_type(self.files[0]), self.height_building, self.width_building, self.index, self.pik_coef_corr, self.area_data, save_dir, self.backend, threadCount, job=self.job)
+                case 'keyed':
+                    processing_type = detect_processing_type(self.files[0])
+                    missing = profiled(envelope_files_keyed)(self.files, processing_type, self.height_building, self.width_building, self.index, self.pik_coef_corr, self.area_data, save_dir)
+        except Cancelled:
+            self.progress.emit('Отменено')
+        else:
+            if missing:
+                self.progress.emit(f'Завершено, точек без совпадений: {missing} (см. {processing_type}_missing.csv); {self.job.summary()}')
+            else:
+                self.progress.emit(f'Завершено: {self.job.summary()}')
+        finally:
+            write_report(self.job, 'pik', {'files': self.files, 'snapshots': self.snapshots, 'epochs': self.epochs, 'height': self.height_building, 'width': self.width_building, 'coef_corr': self.pik_coef_corr, 'join': self.join, 'backend': self.backend, 'workers': threadCount})
+            self.finished.emit()
 
 
 class MainWindow(QMainWindow):
@@ -276,6 +263,37 @@ class MainWindow(QMainWindow):
         self.dzeta10_label.setText(str(CONSTANTS.AREA_TYPES.get(self.area_type.currentText())[2]))
         self.dzeta10_label.setToolTip('ζ<sub>10</sub>')
 
+        hbox_3 = QHBoxLayout()
+        hbox_3.setAlignment(align_left)
+        hbox_3.setSpacing(2)
+        backend_label = QLabel('Режим вычислений')
+        backend_label.setFixedWidth(175)
+        hbox_3.addWidget(backend_label)
+        self.backend = QComboBox()
+        hbox_3.addWidget(self.backend)
+        backend = self.backend
+        backend.setObjectName('backend')
+        backend.setStyleSheet(combobox_style)
+        backend.setFixedHeight(label_height)
+        backend.setFixedWidth(90)
+        backend.addItems(CONSTANTS.BACKENDS.keys())
+
+        hbox_4 = QHBoxLayout()
+        hbox_4.setAlignment(align_left)
+        hbox_4.setSpacing(2)
+        input_kind_label = QLabel('Исходные файлы')
+        input_kind_label.setFixedWidth(175)
+        hbox_4.addWidget(input_kind_label)
+        self.input_kind = QComboBox()
+        hbox_4.addWidget(self.input_kind)
+        input_kind = self.input_kind
+        input_kind.setObjectName('input_kind')
+        input_kind.setStyleSheet(combobox_style)
+        input_kind.setFixedHeight(label_height)
+        input_kind.setFixedWidth(230)
+        input_kind.addItems(CONSTANTS.INPUT_KINDS.keys())
+        input_kind.setToolTip('Снимки давления на каждом шаге по времени: mean, max, min и std считаются за один проход')
+
         group_box = QGroupBox('Параметры здания')
         group_box.setAlignment(align_center)
         group_box.setStyleSheet(self.box_style)
@@ -331,6 +349,8 @@ class MainWindow(QMainWindow):
 
         vbox.addLayout(hbox_0)
         vbox.addLayout(hbox_1)
+        vbox.addLayout(hbox_3)
+        vbox.addLayout(hbox_4)
         vbox.addWidget(group_box)
         widget.setLayout(vbox)
         return widget
@@ -448,6 +468,52 @@ class MainWindow(QMainWindow):
         hbox_4.addWidget(calculate_puls_button)
         calculate_puls_button.clicked.connect(self.process_files_puls_parallel)
 
+        self.calculate_sweep_button = QPushButton('Все варианты', self)
+        calculate_sweep_button = self.calculate_sweep_button
+        calculate_sweep_button.setStyleSheet('''
+            QPushButton {
+                background-color: #E5FFCC; border-radius: 5px;
+            }
+            QPushButton:hover {
+                border: 0px;
+                background: black;
+                color: white;
+            }
+            QPushButton:pressed {
+                border: 0px;
+                background: black;
+                color: white;
+            }
+        ''')
+        calculate_sweep_button.setFixedHeight(label_height)
+        calculate_sweep_button.setFixedWidth(110)
+        calculate_sweep_button.setToolTip('Все типы местности и оба декремента для выбранного ветрового района,\nрезультаты в папках <тип>_<район>_<декремент>')
+        hbox_4.addWidget(calculate_sweep_button)
+        calculate_sweep_button.clicked.connect(self.process_files_sweep_parallel)
+
+        self.cancel_puls_button = QPushButton('Отмена', self)
+        cancel_puls_button = self.cancel_puls_button
+        cancel_puls_button.setStyleSheet('''
+            QPushButton {
+                background-color: #E0E0E0; border-radius: 5px;
+            }
+            QPushButton:hover {
+                border: 0px;
+                background: black;
+                color: white;
+            }
+            QPushButton:pressed {
+                border: 0px;
+                background: black;
+                color: white;
+            }
+        ''')
+        cancel_puls_button.setFixedHeight(label_height)
+        cancel_puls_button.setFixedWidth(70)
+        cancel_puls_button.setDisabled(True)
+        hbox_4.addWidget(cancel_puls_button)
+        cancel_puls_button.clicked.connect(self.cancel_puls)
+
         self.status_label_puls = QLabel('', self)
         self.status_label_puls.setVisible(False)
         hbox_4.addWidget(self.status_label_puls)
@@ -494,6 +560,37 @@ class MainWindow(QMainWindow):
         coef_corr_input.setValidator(coef_corr_input_validator)
         coef_corr_input.setToolTip('0...100')
 
+        hbox_3 = QHBoxLayout()
+        hbox_3.setAlignment(align_left)
+        hbox_3.setSpacing(2)
+        join_label = QLabel('Сопоставление точек')
+        join_label.setFixedWidth(250)
+        hbox_3.addWidget(join_label)
+        self.join = QComboBox()
+        hbox_3.addWidget(self.join)
+        join = self.join
+        join.setObjectName('join')
+        join.setStyleSheet(combobox_style)
+        join.setFixedHeight(label_height)
+        join.setFixedWidth(130)
+        join.addItems(CONSTANTS.JOIN_MODES.keys())
+
+        hbox_4 = QHBoxLayout()
+        hbox_4.setAlignment(align_left)
+        hbox_4.setSpacing(2)
+        peak_estimate_label = QLabel('Пики по снимкам')
+        peak_estimate_label.setFixedWidth(250)
+        hbox_4.addWidget(peak_estimate_label)
+        self.peak_estimate = QComboBox()
+        hbox_4.addWidget(self.peak_estimate)
+        peak_estimate = self.peak_estimate
+        peak_estimate.setObjectName('peak_estimate')
+        peak_estimate.setStyleSheet(combobox_style)
+        peak_estimate.setFixedHeight(label_height)
+        peak_estimate.setFixedWidth(170)
+        peak_estimate.addItems(CONSTANTS.PEAK_ESTIMATES.keys())
+        peak_estimate.setToolTip(f'Гумбель: запись делится на {CONSTANTS.PEAK_EPOCHS} интервалов, пик — U + 1.4/a по их экстремумам')
+
         hbox_2 = QHBoxLayout()
         hbox_2.setAlignment(align_left)
         self.calculate_pik_button = QPushButton('Рассчитать', self)
@@ -518,11 +615,36 @@ class MainWindow(QMainWindow):
         hbox_2.addWidget(calculate_pik_button)
         calculate_pik_button.clicked.connect(self.sort_files_parallel)
 
+        self.cancel_pik_button = QPushButton('Отмена', self)
+        cancel_pik_button = self.cancel_pik_button
+        cancel_pik_button.setStyleSheet('''
+            QPushButton {
+                background-color: #E0E0E0; border-radius: 5px;
+            }
+            QPushButton:hover {
+                border: 0px;
+                background: black;
+                color: white;
+            }
+            QPushButton:pressed {
+                border: 0px;
+                background: black;
+                color: white;
+            }
+        ''')
+        cancel_pik_button.setFixedHeight(label_height)
+        cancel_pik_button.setFixedWidth(70)
+        cancel_pik_button.setDisabled(True)
+        hbox_2.addWidget(cancel_pik_button)
+        cancel_pik_button.clicked.connect(self.cancel_pik)
+
         self.status_label_pik = QLabel('', self)
         self.status_label_pik.setVisible(False)
         hbox_2.addWidget(self.status_label_pik)
 
         vbox.addLayout(hbox_1)
+        vbox.addLayout(hbox_3)
+        vbox.addLayout(hbox_4)
         vbox.addLayout(hbox_2)
         widget.setLayout(vbox)
         return widget
@@ -532,7 +654,7 @@ class MainWindow(QMainWindow):
         options = QFileDialog.Options()
 
         file_dialog = QFileDialog()
-        self.files, _ = file_dialog.getOpenFileNames(self, 'Выбрать файлы', '', 'CSV Files (*.csv);;All Files (*)', options=options)
+        self.files, _ = file_dialog.getOpenFileNames(self, 'Выбрать файлы', '', 'CSV Files (*.csv *.csv.gz *.csv.zst);;Tables (*.npz *.parquet *.arrow);;All Files (*)', options=options)
         if self.files:
             self.count_files.setText(str(len(self.files)))
 
@@ -560,13 +682,7 @@ class MainWindow(QMainWindow):
         height = self.height_building.text()
         width = self.width_building.text()
         if height and width:
-            height, width = float(height), float(width)
-            if height <= width:
-                self.index.setText('1')
-            elif height > (2 * width):
-                self.index.setText('3')
-            else:
-                self.index.setText('2')
+            self.index.setText(str(building_index(float(height), float(width))))
 
 
     def activate_frequency_calculation(self, value) -> None:
@@ -679,12 +795,8 @@ class MainWindow(QMainWindow):
         alfa = data[0]
         k_10 = data[1]
         if all([height, alfa, k_10]):
-            height = float(height)
-            alfa = float(alfa)
-            k_10 = float(k_10)
-            result = k_10 * pow((height * 0.8 / 10), (2 * alfa))
-            result = '{:.3f}'.format(round(result, 3))
-            self.zet.setText(result)
+            result = calculate_zet(float(height), float(alfa), float(k_10))
+            self.zet.setText('{:.3f}'.format(result))
         else:
             self.zet.setText('')
 
@@ -701,10 +813,8 @@ class MainWindow(QMainWindow):
         zet = self.zet.text()
         frequency = self.frequency_input.text()
         if all([pressure, zet, frequency]):
-            pressure, zet, frequency = float(pressure), float(zet), float(frequency)
-            result = pow((pressure * zet * 1.4), 0.5) / 940 / frequency
-            result = '{:.3f}'.format(round(result, 3))
-            self.e1.setText(result)
+            result = calculate_e1(float(pressure), float(zet), float(frequency))
+            self.e1.setText('{:.3f}'.format(result))
         else:
             self.e1.setText('')
 
@@ -712,17 +822,8 @@ class MainWindow(QMainWindow):
     def calculate_dynamic(self, value) -> None:
         e1 = self.e1.text()
         if e1:
-            e1 = float(e1)
-            decrement = self.decrement_input.currentText()
-            match decrement:
-                case '0.3':
-                    result = -1917.9 * pow(e1, 4) + 971.95 * pow(e1, 3) - 187.65 * pow(e1, 2) + 19.745 * e1 + 1
-                    result = '{:.3f}'.format(round(result, 3))
-                    self.dynamic.setText(result)
-                case '0.15':
-                    result = -3333.3 * pow(e1, 4) + 1666.7 * pow(e1, 3) - 311.67 * pow(e1, 2) + 31.833 * e1 + 1
-                    result = '{:.3f}'.format(round(result, 3))
-                    self.dynamic.setText(result)
+            result = calculate_dynamic(float(e1), self.decrement_input.currentText())
+            self.dynamic.setText('{:.3f}'.format(result))
         else:
             self.dynamic.setText('')
 
@@ -739,6 +840,22 @@ class MainWindow(QMainWindow):
             return 1
 
 
+    def get_backend(self) -> str:
+        return CONSTANTS.BACKENDS.get(self.backend.currentText())
+
+
+    def get_snapshots(self) -> bool:
+        return CONSTANTS.INPUT_KINDS.get(self.input_kind.currentText()) == 'snapshots'
+
+
+    def get_epochs(self) -> int:
+        return CONSTANTS.PEAK_ESTIMATES.get(self.peak_estimate.currentText())
+
+
+    def get_join(self) -> str:
+        return CONSTANTS.JOIN_MODES.get(self.join.currentText())
+
+
     def get_coef_corr_puls(self) -> float:
         if self.puls_coef_corr_input.text():
             return float(self.puls_coef_corr_input.text())
@@ -762,38 +879,82 @@ class MainWindow(QMainWindow):
             QMessageBox.critical(self, 'Ошибка', 'Не рассчитан коэффициент динамичности')
         elif not self.index:
             QMessageBox.critical(self, 'Ошибка', 'Не рассчитан индекс')
-        elif 'mean' not in self.files[0]:
+        elif not self.get_snapshots() and 'mean' not in self.files[0]:
             QMessageBox.critical(self, 'Ошибка', 'Похоже, исходные файлы для другого расчёта')
         else:
             self.status_label_puls.setVisible(True)
             self.status_label_puls.setText('Процесс пошёл ...')
 
-            height_building = float(self.height_building.text())
-            width_building = float(self.width_building.text())
-            index = int(self.index.text())
             dynamic = self.get_dynamic()
-            coef_corr = self.get_coef_corr_puls()
             area_data = CONSTANTS.AREA_TYPES.get(self.area_type.currentText())
-            files = self.files
+            self.start_puls_worker(dynamic, area_data)
+
+
+    def process_files_sweep_parallel(self) -> None:
+        frequency = CONSTANTS.BUILDING_FREQUENCY.get(self.frequency.currentText())
+        if not self.files:
+            QMessageBox.critical(self, 'Ошибка', 'Нет файлов для расчёта')
+        elif not all([self.height_building.text(), self.width_building.text()]):
+            QMessageBox.critical(self, 'Ошибка', 'Отсутствуют размеры здания')
+        elif frequency and not all([self.frequency_input.text(), self.wind_area_input.text()]):
+            QMessageBox.critical(self, 'Ошибка', 'Не заданы частота здания или давление ветра')
+        elif not self.index:
+            QMessageBox.critical(self, 'Ошибка', 'Не рассчитан индекс')
+        elif not self.get_snapshots() and 'mean' not in self.files[0]:
+            QMessageBox.critical(self, 'Ошибка', 'Похоже, исходные файлы для другого расчёта')
+        else:
+            self.status_label_puls.setVisible(True)
+            self.status_label_puls.setText('Процесс пошёл ...')
+
+            wind_area = self.wind_area.currentText()
+            if not CONSTANTS.WIND_AREA.get(wind_area):
+                wind_area = self.wind_area_input.text()
+            scenarios = sweep_scenarios(
+                float(self.height_building.text()),
+                CONSTANTS.AREA_TYPES.keys(),
+                [wind_area],
+                CONSTANTS.DECREMENT,
+                float(self.frequency_input.text()) if frequency else None,
+            )
+            self.start_puls_worker(1, None, scenarios)
+
+
+    def start_puls_worker(self, dynamic, area_data, scenarios=None) -> None:
+        height_building = float(self.height_building.text())
+        width_building = float(self.width_building.text())
+        index = int(self.index.text())
+        coef_corr = self.get_coef_corr_puls()
+        files = self.files
 
-            self.puls_thread = QThread()
-            self.puls_worker = PulsWorker(files, height_building, width_building, index, dynamic, coef_corr, area_data)
-            self.puls_worker.moveToThread(self.puls_thread)
+        self.puls_thread = QThread()
+        self.puls_worker = PulsWorker(files, height_building, width_building, index, dynamic, coef_corr, area_data, self.get_backend(), scenarios, self.get_snapshots())
+        self.puls_worker.moveToThread(self.puls_thread)
 
-            self.puls_thread.started.connect(self.puls_worker.run)
-            self.puls_thread.start()
-            self.calculate_puls_button.setDisabled(True)
-            self.puls_thread.quit()
+        self.puls_thread.started.connect(self.puls_worker.run)
+        self.puls_thread.start()
+        self.calculate_puls_button.setDisabled(True)
+        self.calculate_sweep_button.setDisabled(True)
+        self.cancel_puls_button.setDisabled(False)
+        self.puls_thread.quit()
 
-            self.puls_worker.finished.connect(self.puls_thread.quit)
-            self.puls_worker.finished.connect(self.puls_worker.deleteLater)
-            self.puls_worker.time.connect(self.report_puls_finish)
-            self.puls_thread.finished.connect(self.puls_thread.deleteLater)
-            self.puls_thread.finished.connect(lambda: self.calculate_puls_button.setDisabled(False))
+        self.puls_worker.finished.connect(self.puls_thread.quit)
+        self.puls_worker.finished.connect(self.puls_worker.deleteLater)
+        self.puls_worker.progress.connect(self.status_label_puls.setText)
+        self.puls_worker.time.connect(self.report_puls_finish)
+        self.puls_thread.finished.connect(self.puls_thread.deleteLater)
+        self.puls_thread.finished.connect(lambda: self.calculate_puls_button.setDisabled(False))
+        self.puls_thread.finished.connect(lambda: self.calculate_sweep_button.setDisabled(False))
+        self.puls_thread.finished.connect(lambda: self.cancel_puls_button.setDisabled(True))
+
+
+    def cancel_puls(self) -> None:
+        self.cancel_puls_button.setDisabled(True)
+        self.status_label_puls.setText('Отмена ...')
+        self.puls_worker.job.cancel()
 
 
     def report_puls_finish(self, time) -> None:
-        self.status_label_puls.setText('Выполнено')
+        self.status_label_puls.setText(f'Выполнено за {time}')
 
 
     def sort_files_parallel(self) -> None:
@@ -803,116 +964,45 @@ class MainWindow(QMainWindow):
             QMessageBox.critical(self, 'Ошибка', 'Отсутствуют размеры здания')
         elif not self.index:
             QMessageBox.critical(self, 'Ошибка', 'Не рассчитан индекс')
-        elif 'mean' in self.files[0]:
+        elif not self.get_snapshots() and 'mean' in self.files[0]:
             QMessageBox.critical(self, 'Ошибка', 'Похоже, исходные файлы для другого расчёта')
+        elif self.get_snapshots() and self.get_epochs() > len(self.files):
+            QMessageBox.critical(self, 'Ошибка', f'Для оценки пиков нужно не меньше {self.get_epochs()} снимков')
         else:
             height_building = float(self.height_building.text())
             width_building = float(self.width_building.text())
             index = int(self.index.text())
             coef_corr = self.get_coef_corr_pik()
             area_data = CONSTANTS.AREA_TYPES.get(self.area_type.currentText())
+            join = self.get_join()
             files = self.files
             self.status_label_pik.setVisible(True)
 
-            self.sort_thread = QThread()
-            self.sort_worker = SortWorker(files)
-            self.sort_worker.moveToThread(self.sort_thread)
-
-            self.sort_thread.started.connect(self.sort_worker.run)
-            self.sort_thread.start()
-            self.calculate_pik_button.setDisabled(True)
-            self.sort_thread.quit()
-
-            self.sort_worker.finished.connect(self.sort_thread.quit)
-            self.sort_worker.finished.connect(self.sort_worker.deleteLater)
-            self.sort_worker.progress.connect(self.report_sort_finish)
-            self.sort_thread.finished.connect(self.sort_thread.deleteLater)
-
-
             self.base_file_thread = QThread()
-            self.base_file_worker = PikWorker(files, height_building, width_building, index, coef_corr, area_data)
+            self.base_file_worker = PikWorker(files, height_building, width_building, index, coef_corr, area_data, join, self.get_backend(), self.get_snapshots(), self.get_epochs())
             self.base_file_worker.moveToThread(self.base_file_thread)
-
             self.base_file_thread.started.connect(self.base_file_worker.run)
-            self.sort_thread.finished.connect(self.base_file_thread.start)
             self.calculate_pik_button.setDisabled(True)
-            self.base_file_thread.quit()
 
             self.base_file_worker.finished.connect(self.base_file_thread.quit)
             self.base_file_worker.finished.connect(self.base_file_worker.deleteLater)
             self.base_file_worker.progress.connect(self.report_sort_finish)
             self.base_file_thread.finished.connect(self.base_file_thread.deleteLater)
             self.base_file_thread.finished.connect(lambda: self.calculate_pik_button.setDisabled(False))
+            self.base_file_thread.finished.connect(lambda: self.cancel_pik_button.setDisabled(True))
+            self.cancel_pik_button.setDisabled(False)
+            self.pik_job = self.base_file_worker.job
+            self.base_file_thread.start()
 
 
-    def report_sort_finish(self, msg) -> None:
-        self.status_label_pik.setText(msg)
-
-
-def process_file_puls(file, height_building, width_building, index, dynamic, coef_corr, area_data) -> None:
-    alfa = area_data[0]
-    dzeta10 = area_data[2]
-
-    b = db.read_text(file, blocksize=10000000)
-    records = b.str.strip().str.split('\t')
-    header = records.compute()[0]
-
-    combined_bag = dask.bag.from_sequence(records.compute(), npartitions=1)
-    filtered_bag = combined_bag.filter(lambda r: not r[0].startswith(header[0]))
-
-    file_name = file.split('/')[-1].split('_')[0]
-    new_file_name = f'{save_dir}\{file_name}_puls.csv'
-
-    new_lines = []
-    for line in filtered_bag.compute():
-        new_line = process_row_puls(line, index, height_building, width_building, dynamic, coef_corr, alfa, dzeta10)
-        new_lines.append(new_line)
-
-    with open(new_file_name, 'w', newline='') as f:
-        writer = csv.writer(f, delimiter=' ')
-        writer.writerow(['Puls', 'X(m)', 'Y(m)', 'Z(m)'])
-        writer.writerows(new_lines)
-
-
-def process_row_puls(row, index, height_building, width_building, dynamic, coef_corr, alfa, dzeta10) -> List[str]:
-    X, Y, Z = row[1], row[2], row[3]
-    pressure = float(row[0])
-    dimension = height_building - width_building
-    match index:
-        case 1:
-            result = pressure * (dzeta10 * pow(height_building / 10, -alfa)) * dynamic * coef_corr + pressure
-        case 2:
-            if float(Z) >= dimension:
-                result = pressure * (dzeta10 * pow(height_building / 10, -alfa)) * dynamic * coef_corr + pressure
-            else:
-                result = pressure * (dzeta10 * pow(width_building / 10, -alfa)) * dynamic * coef_corr + pressure
-        case 3:
-            if float(Z) >= dimension:
-                result = pressure * (dzeta10 * pow(height_building / 10, -alfa)) * dynamic * coef_corr + pressure
-            else:
-                if float(Z) <= width_building:
-                    result = pressure * (dzeta10 * pow(width_building / 10, -alfa)) * dynamic * coef_corr + pressure
-                else:
-                    result = pressure * (dzeta10 * pow(float(Z) / 10, -alfa)) * dynamic * coef_corr + pressure
-    new_row = [str(result), X, Y, Z]
-    return new_row
-
-
-def sort_files(file) -> None:
-    df = pd.read_csv(file, delimiter=' ')
-    headers = list(df.columns)
-    # print(headers)
-    df_sorted = df.sort_values(by=[headers[1], headers[2], headers[3]])
-    if df_sorted['Max of Pressure (Pa)'].str.contains('e').any():
-        df_sorted['Max of Pressure (Pa)'] = df_sorted['Max of Pressure (Pa)'].str.split(pat='e', expand=True)[0]
-
-    df_sorted.to_csv(file, index=False, sep='\t')
-
-
-
-
+    def cancel_pik(self) -> None:
+        self.cancel_pik_button.setDisabled(True)
+        self.status_label_pik.setText('Отмена ...')
+        self.pik_job.cancel()
 
 
+    def report_sort_finish(self, msg) -> None:
+        self.status_label_pik.setText(msg)
 
 
 if __name__ == '__main__':
@@ -927,4 +1017,7 @@ if __name__ == '__main__':
     window.setIconSize(QSize(15, 15))
     window.setStyleSheet('QMainWindow::title { background: black; }')
     window.show()
+    if os.environ.get('MMTT_STARTUP_EXIT'):
+        # benchmark.py --startup: quit as soon as the window is shown
+        QTimer.singleShot(0, app.quit)
     sys.exit(app.exec())
@@ -0,0 +1,56 @@
+# -*- mode: python ; coding: utf-8 -*-
+
+
+block_cipher = None
+
+version = 'v0.0.1'
+
+a = Analysis(
+    ['app.py'],
+    pathex=[],
+    binaries=[],
+    datas=[
+        ('app.ico', '.'),
+    ],
+    # packages of the build environment the app does not use
+    excludes=['tests', 'dask', 'distributed', 'pandas', 'pyarrow', 'scipy', 'matplotlib', 'IPython', 'tkinter'],
+    hiddenimports=[],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    win_no_prefer_redirects=False,
+    win_private_assemblies=False,
+    cipher=block_cipher,
+    noarchive=False,
+)
+pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
+
+# a folder build starts without unpacking to a temporary directory, use it where the start time matters
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name=f'mm-technologies-tools_{version}',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=False,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+    icon='app.ico',
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.zipfiles,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name=f'mm-technologies-tools_{version}',
+)
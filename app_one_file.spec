@@ -11,10 +11,10 @@ a = Analysis(
     binaries=[],
     datas=[
         ('app.ico', '.'),
-        ('./env_wind/Lib/site-packages/dask/dask.yaml', './dask/'),
-        ('./env_wind/Lib/site-packages/distributed', './distributed/'),
     ],
-    excludes=['tests'],
+    # everything a one-file build carries is unpacked on every start, so packages of the build
+    # environment the app does not use are kept out
+    excludes=['tests', 'dask', 'distributed', 'pandas', 'pyarrow', 'scipy', 'matplotlib', 'IPython', 'tkinter'],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
@@ -0,0 +1,357 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import itertools
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import freeze_support, get_context
+
+import numpy as np
+
+from coefficients import building_index, calculate_dynamic, calculate_e1, calculate_zet
+from constants import CONSTANTS
+from fileio import open_output, write_header, write_table
+
+
+# Benchmarks on synthetic STAR-CCM+ exports:
+#
+#     python benchmark.py --preset quick
+#     python benchmark.py --rows 1000000 --files 10 --shuffle --baseline bench/results/<earlier run>.json
+#
+# Generated datasets are kept in <workdir>/data and reused by later runs with the same settings.
+# Every run of a case is done in a fresh process, the results (median wall time, throughput,
+# stage times and peak memory) are saved to <workdir>/results. With --baseline the results are
+# compared with an earlier run and the exit status is 1 when throughput dropped more than --threshold.
+#
+#     python benchmark.py --startup
+#     python benchmark.py --startup dist/mm-technologies-tools_v0.0.1/mm-technologies-tools_v0.0.1.exe
+#
+# times the start of the GUI instead: the import of app.py, which must not load numpy, and the time until
+# the window is shown, of python app.py or of a frozen build.
+
+CASES = {
+    'puls': 'mean',  # process_file_puls, files one after another
+    'puls-parallel': 'mean',  # process_files_puls with the selected backend
+    'sort': 'pik',  # process_files_sort
+    'envelope-sorted': 'pik',  # PikWorker, sorting mode: envelope_files_sorted
+    'envelope-keyed': 'pik',  # PikWorker, coordinate mode: envelope_files_keyed
+}
+PRESETS = {
+    'quick': [(100000, 2)],
+    'standard': [(100000, 50), (1000000, 10), (5000000, 2)],
+    'large': [(20000000, 1), (20000000, 4)],
+}
+HEADERS = {
+    'mean': 'Mean of Pressure (Pa)',
+    'max': 'Max of Pressure (Pa)',
+    'min': 'Min of Pressure (Pa)',
+}
+# a tall building so that all three height zones of the profile are used
+HEIGHT_BUILDING = 120.0
+WIDTH_BUILDING = 40.0
+AREA_TYPE = 'B'
+WIND_AREA = '2 (СПб)'
+FREQUENCY = 0.45
+GENERATE_ROWS = 1000000
+STARTUP_IMPORT = "import sys; import app; sys.exit('numpy' in sys.modules and 'numpy is imported at startup')"
+
+
+def dataset_dir(workdir, kind, rows, files, sci, shuffle, seed) -> str:
+    name = f'{kind}-{rows}x{files}-{"sci" if sci else "plain"}{"-shuffled" if shuffle else ""}-{seed}'
+    return os.path.join(workdir, 'data', name)
+
+
+def generate(workdir, kind, rows, files, sci, shuffle, seed) -> list:
+    directory = dataset_dir(workdir, kind, rows, files, sci, shuffle, seed)
+    names = [os.path.join(directory, f'{i + 1}_{kind}.csv') for i in range(files)]
+    done = os.path.join(directory, 'complete')
+    if os.path.exists(done):
+        return names
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    print(f'Генерация {directory} (~{rows * files * 70 / 1024 ** 2:,.0f} МБ) ...', flush=True)
+    rng = np.random.default_rng(seed)
+    # every file of a dataset holds the same points, as the exports of one model do
+    xyz = np.column_stack((
+        rng.uniform(-WIDTH_BUILDING, WIDTH_BUILDING, rows),
+        rng.uniform(-WIDTH_BUILDING, WIDTH_BUILDING, rows),
+        rng.uniform(0, HEIGHT_BUILDING, rows),
+    ))
+    for name in names:
+        order = rng.permutation(rows) if shuffle else np.arange(rows)
+        with open_output(name) as f:
+            write_header(f, [HEADERS[kind], 'X(m)', 'Y(m)', 'Z(m)'], '\t')
+            for start in range(0, rows, GENERATE_ROWS):
+                block = order[start:start + GENERATE_ROWS]
+                pressure = rng.normal(-150 if kind == 'min' else 150, 300, len(block))
+                write_table(f, np.column_stack((pressure, xyz[block])), '\t', 6 if sci else None)
+    open(done, 'w').close()
+    return names
+
+
+def prepare(case, files, scratch) -> list:
+    # sort_files rewrites its input, so that case works on copies
+    if case != 'sort':
+        return files
+    copies = []
+    for file in files:
+        copy = os.path.join(scratch, os.path.basename(file))
+        shutil.copyfile(file, copy)
+        copies.append(copy)
+    return copies
+
+
+def run_case(case, files, scratch, backend, workers, pik_kind, output_format) -> dict:
+    # runs in a fresh process, the imports are part of the process start and not timed
+    from calculations import envelope_files_keyed, envelope_files_sorted, process_file_puls, process_files_puls, process_files_sort
+    from profiling import peak_rss, timings, write_report
+    from progress import Job
+
+    area_data = CONSTANTS.AREA_TYPES[AREA_TYPE]
+    index = building_index(HEIGHT_BUILDING, WIDTH_BUILDING)
+    zet = calculate_zet(HEIGHT_BUILDING, area_data[0], area_data[1])
+    dynamic = calculate_dynamic(calculate_e1(float(CONSTANTS.WIND_AREA[WIND_AREA]), zet, FREQUENCY), CONSTANTS.DECREMENT[0])
+    puls_coef_corr = float(CONSTANTS.COEF_SPATIAL_CORR_PULS)
+    pik_coef_corr = float(CONSTANTS.COEF_SPATIAL_CORR_PIK)
+
+    job = Job(backend)
+    job.connect()
+    start = time.perf_counter()
+    match case:
+        case 'puls':
+            for file in files:
+                process_file_puls(file, HEIGHT_BUILDING, WIDTH_BUILDING, index, dynamic, puls_coef_corr, area_data, scratch, output_format=output_format)
+        case 'puls-parallel':
+            process_files_puls(files, HEIGHT_BUILDING, WIDTH_BUILDING, index, dynamic, puls_coef_corr, area_data, scratch, backend, workers, output_format=output_format, job=job)
+        case 'sort':
+            process_files_sort(files, backend, workers, job)
+        case 'envelope-sorted':
+            envelope_files_sorted(files, pik_kind, HEIGHT_BUILDING, WIDTH_BUILDING, index, pik_coef_corr, area_data, scratch, backend, workers, output_format=output_format, job=job)
+        case 'envelope-keyed':
+            envelope_files_keyed(files, pik_kind, HEIGHT_BUILDING, WIDTH_BUILDING, index, pik_coef_corr, area_data, scratch, output_format=output_format)
+    wall = time.perf_counter() - start
+    job.poll()
+    # the sorted inputs are rewritten in place and count as outputs too
+    outputs = [os.path.join(root, name) for root, _, names in os.walk(scratch) for name in names]
+    write_report(job, case, {'files': files, 'backend': backend, 'workers': workers})
+    return {
+        'wall': wall,
+        'cpu': sum(job.cpu.values()),
+        'stages': timings(job.stages, job.cpu),
+        'peak_rss': max([peak_rss(), *job.peak_rss.values()]),
+        'output_bytes': sum(os.path.getsize(output) for output in outputs),
+    }
+
+
+def run_in_process(*args) -> dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(run_case, *args).result()
+
+
+def measure(case, files, args) -> dict:
+    scratch = os.path.join(args.workdir, 'scratch')
+    runs = []
+    # with a warm cache the first, cache filling run is not counted
+    for attempt in range(args.repeat + (args.cache == 'warm')):
+        shutil.rmtree(scratch, ignore_errors=True)
+        os.makedirs(scratch)
+        if args.cache != 'warm':
+            shutil.rmtree(os.path.join(os.path.dirname(files[0]), CONSTANTS.MESH_CACHE_DIR), ignore_errors=True)
+        if args.cache == 'cold':
+            shutil.rmtree(os.environ['MMTT_CACHE_DIR'], ignore_errors=True)
+        inputs = prepare(case, files, scratch)
+        result = run_in_process(case, inputs, scratch, args.backend, args.workers, args.pik_kind, args.format)
+        if args.cache == 'warm' and attempt == 0:
+            continue
+        runs.append(result)
+    shutil.rmtree(scratch, ignore_errors=True)
+
+    median = sorted(runs, key=lambda run: run['wall'])[len(runs) // 2]
+    return {
+        'wall': median['wall'],
+        'walls': [run['wall'] for run in runs],
+        'cpu': median['cpu'],
+        'stages': median['stages'],
+        'peak_rss': max(run['peak_rss'] for run in runs),
+        'output_bytes': median['output_bytes'],
+    }
+
+
+def measure_startup(exe, repeat) -> list:
+    # every start is a fresh process; the app quits by itself once its window is shown
+    env = {**os.environ, 'MMTT_STARTUP_EXIT': '1'}
+    basedir = os.path.dirname(os.path.abspath(__file__))
+    commands = {'startup-window': [os.path.abspath(exe)]} if exe else {
+        'startup-import': [sys.executable, '-c', STARTUP_IMPORT],
+        'startup-window': [sys.executable, os.path.join(basedir, 'app.py')],
+    }
+    results = []
+    for case, command in commands.items():
+        result = {'case': case, 'target': os.path.basename(exe) if exe else 'python'}
+        print(f'{result_key(result)} ...', flush=True)
+        walls = []
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                completed = subprocess.run(command, env=env, cwd=basedir, capture_output=True, text=True, timeout=120)
+                walls.append(time.perf_counter() - start)
+                if completed.returncode:
+                    lines = completed.stderr.strip().splitlines()
+                    raise RuntimeError(lines[-1] if lines else f'exit status {completed.returncode}')
+        except (OSError, RuntimeError, subprocess.TimeoutExpired) as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+        else:
+            result['wall'] = sorted(walls)[len(walls) // 2]
+            result['walls'] = walls
+        results.append(result)
+    return results
+
+
+def result_key(result) -> str:
+    if result['case'].startswith('startup'):
+        return f'{result["case"]}/{result["target"]}'
+    key = f'{result["case"]}/{result["rows"]}x{result["files"]}/{result["notation"]}/{"shuffled" if result["shuffle"] else "ordered"}/{result["backend"]}/{result["cache"]}'
+    # results from before the output formats were all CSV
+    output_format = result.get('format', 'csv')
+    return key if output_format == 'csv' else f'{key}/{output_format}'
+
+
+def compare(results, baseline_file, threshold) -> list:
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = {result_key(result): result for result in json.load(f)['results'] if 'error' not in result}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result_key(result))
+        if previous is None or 'error' in result:
+            continue
+        if 'rows_per_second' in result:
+            result['baseline'] = previous['rows_per_second']
+            result['change'] = result['rows_per_second'] / previous['rows_per_second'] - 1
+        else:
+            # start times, a longer time is a drop
+            result['baseline'] = previous['wall']
+            result['change'] = previous['wall'] / result['wall'] - 1
+        if result['change'] < -threshold:
+            regressions.append(result)
+    return regressions
+
+
+def print_results(results) -> None:
+    print(f'{"тест":<56} {"время, с":>10} {"строк/с":>12} {"МБ/с":>8} {"память, МБ":>11} {"к базе":>8}')
+    for result in results:
+        if 'error' in result:
+            print(f'{result_key(result):<56} ошибка: {result["error"]}')
+            continue
+        change = f'{result["change"]:+.0%}' if 'change' in result else ''
+        if 'rows_per_second' not in result:
+            print(f'{result_key(result):<56} {result["wall"]:>10.2f} {"":>12} {"":>8} {"":>11} {change:>8}')
+            continue
+        print(f'{result_key(result):<56} {result["wall"]:>10.2f} {result["rows_per_second"]:>12,.0f} {result["mb_per_second"]:>8.1f} {result["peak_rss"] / 1024 ** 2:>11.0f} {change:>8}')
+        stages = ', '.join(f'{stage} {times["wall"]:.2f}' for stage, times in result['stages'].items())
+        if 'output_bytes' in result:
+            stages = ', '.join(filter(None, [stages, f'вывод {result["output_bytes"] / 1024 ** 2:.1f} МБ']))
+        if stages:
+            print(f'{"":<56} {stages}')
+
+
+def parse_args(argv) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='benchmark', description='Замеры производительности на синтетических данных STAR-CCM+')
+    parser.add_argument('--preset', choices=PRESETS.keys(), default='quick', help='наборы (строк, файлов), если не заданы --rows/--files')
+    parser.add_argument('--rows', type=int, nargs='+', help='строк в файле')
+    parser.add_argument('--files', type=int, nargs='+', help='файлов в наборе')
+    parser.add_argument('--cases', nargs='+', choices=CASES.keys(), default=list(CASES.keys()))
+    parser.add_argument('--notation', choices=('sci', 'plain'), default='sci', help='запись давления: 1.234560e+02 или repr')
+    parser.add_argument('--shuffle', action='store_true', help='разный порядок точек в файлах')
+    parser.add_argument('--pik-kind', dest='pik_kind', choices=('max', 'min'), default='max')
+    parser.add_argument('--backend', choices=CONSTANTS.BACKENDS.values(), default=list(CONSTANTS.BACKENDS.values())[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--cache', choices=('off', 'cold', 'warm'), default='off', help='кэш разобранных файлов: отключён, пустой перед каждым запуском или заполнен заранее')
+    parser.add_argument('--format', choices=CONSTANTS.OUTPUT_FORMATS.keys(), default=CONSTANTS.OUTPUT_FORMAT, help='формат выходных файлов')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default='bench')
+    parser.add_argument('--output', help='файл результатов (по умолчанию <workdir>/results/<время>.json)')
+    parser.add_argument('--baseline', help='результаты прошлого запуска для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.1, help='допустимое падение пропускной способности')
+    parser.add_argument('--startup', nargs='?', const='', metavar='EXE', help='замерить запуск окна: python app.py или собранная программа')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    started = datetime.datetime.now()
+    if args.rows or args.files:
+        sizes = list(itertools.product(args.rows or [100000], args.files or [1]))
+    else:
+        sizes = PRESETS[args.preset]
+
+    # passed through the environment to the benchmark processes and their workers
+    os.environ['MMTT_CACHE_DIR'] = os.path.abspath(os.path.join(args.workdir, 'cache'))
+    if args.cache == 'off':
+        os.environ['MMTT_CACHE_SIZE'] = '0'
+    elif not int(os.environ.get('MMTT_CACHE_SIZE', 0)):
+        os.environ['MMTT_CACHE_SIZE'] = str(20 * 1024 ** 3)
+    os.environ['MMTT_PROFILE'] = os.path.abspath(os.path.join(args.workdir, 'reports', f'{started:%Y%m%d-%H%M%S}'))
+
+    sci = args.notation == 'sci'
+    results = []
+    if args.startup is not None:
+        results = measure_startup(args.startup, args.repeat)
+        sizes = []
+    for (rows, files), case in itertools.product(sizes, args.cases):
+        kind = 'mean' if CASES[case] == 'mean' else args.pik_kind
+        inputs = generate(args.workdir, kind, rows, files, sci, args.shuffle, args.seed)
+        result = {
+            'case': case,
+            'rows': rows,
+            'files': files,
+            'notation': args.notation,
+            'shuffle': args.shuffle,
+            'backend': args.backend,
+            'workers': args.workers,
+            'cache': args.cache,
+            'format': args.format,
+        }
+        print(f'{result_key(result)} ...', flush=True)
+        try:
+            measured = measure(case, inputs, args)
+        except Exception as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+        else:
+            size = sum(os.path.getsize(file) for file in inputs)
+            result.update(measured)
+            result['rows_per_second'] = rows * files / measured['wall']
+            result['mb_per_second'] = size / 1024 ** 2 / measured['wall']
+        results.append(result)
+
+    regressions = compare(results, args.baseline, args.threshold) if args.baseline else []
+    output = args.output or os.path.join(args.workdir, 'results', f'{started:%Y%m%d-%H%M%S}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': CONSTANTS.VERSION,
+            'started': started.isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'results': results,
+        }, f, ensure_ascii=False, indent=2)
+
+    print_results(results)
+    print(f'Результаты: {output}')
+    for result in regressions:
+        print(f'Замедление: {result_key(result)} {result["change"]:+.0%} к базе', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    freeze_support()
+    sys.exit(main())
@@ -0,0 +1,306 @@
+import os
+import json
+import hashlib
+import shutil
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from columnar import table_format
+from constants import CONSTANTS
+from engine import height_factor
+from fileio import data_size, estimate_rows, iter_parsed, read_array, text_lines, text_rows
+from progress import remove_files
+
+
+_memory = OrderedDict()  # the most recently used tables, texts and factors parsed in this process, at most MEMORY_CACHE_SIZE bytes
+_memory_lock = threading.Lock()
+
+
+def cache_dir() -> str:
+    return os.environ.get('MMTT_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'mm-technologies-tools')
+
+
+def cache_size() -> int:
+    return int(os.environ.get('MMTT_CACHE_SIZE', CONSTANTS.DATA_CACHE_SIZE))
+
+
+def cache_enabled() -> bool:
+    return cache_size() > 0
+
+
+def _stat_file(file) -> str:
+    name = hashlib.blake2b(os.path.abspath(file).encode(), digest_size=16).hexdigest()
+    return os.path.join(cache_dir(), 'stat', f'{name}.json')
+
+
+def _write_atomic(path, data: bytes) -> None:
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def content_key(file) -> str:
+    # hashing multi-GB files takes seconds, so the key of an unchanged file (same size and mtime) is remembered
+    stat = os.stat(file)
+    stat_file = _stat_file(file)
+    try:
+        with open(stat_file, 'r') as f:
+            size, mtime, key = json.load(f)
+        if size == stat.st_size and mtime == stat.st_mtime_ns:
+            return key
+    except (OSError, ValueError):
+        pass
+
+    # the bytes as stored, compressed files are not decompressed for the key
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file, 'rb') as f:
+        while block := f.read(1 << 24):
+            digest.update(block)
+    key = digest.hexdigest()
+    try:
+        os.makedirs(os.path.dirname(stat_file), exist_ok=True)
+        _write_atomic(stat_file, json.dumps([stat.st_size, stat.st_mtime_ns, key]).encode())
+    except OSError:
+        pass
+    return key
+
+
+def table_path(file) -> str:
+    # parsed tables are raw float64 (pressure, X, Y, Z) rows, the row count follows from the size
+    return os.path.join(cache_dir(), f'{content_key(file)}.f8')
+
+
+def text_path(file) -> str:
+    # the coordinate text of every row as text_rows gives it, copied into text outputs instead of formatting floats
+    return os.path.join(cache_dir(), f'{content_key(file)}.txt')
+
+
+def _open_table(path) -> np.ndarray:
+    return np.memmap(path, dtype=np.float64, mode='r').reshape(-1, 4)
+
+
+def _text_ends(text) -> Tuple[np.ndarray, np.ndarray]:
+    # the text and the position of the line end of every row
+    return text, np.flatnonzero(text == 10)
+
+
+def _open_text(path) -> Tuple[np.ndarray, np.ndarray]:
+    if not os.path.getsize(path):
+        return _text_ends(np.empty(0, dtype=np.uint8))
+    return _text_ends(np.memmap(path, dtype=np.uint8, mode='r'))
+
+
+def memory_size(file) -> int:
+    # a table held in memory takes 32 bytes a row and its coordinate text about the size of the input
+    return estimate_rows(file) * 32 + data_size(file)
+
+
+def use_tables(file) -> bool:
+    # whether a file is read whole through load_table: from the disk cache, or into memory when it fits there
+    return cache_enabled() or memory_size(file) <= CONSTANTS.MEMORY_CACHE_SIZE
+
+
+def _recall(key):
+    with _memory_lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            return _memory[key][0]
+    return None
+
+
+def _remember(key, value, nbytes) -> None:
+    if nbytes > CONSTANTS.MEMORY_CACHE_SIZE:
+        return
+    with _memory_lock:
+        _memory[key] = value, nbytes
+        total = sum(size for _, size in _memory.values())
+        while total > CONSTANTS.MEMORY_CACHE_SIZE:
+            _, (_, size) = _memory.popitem(last=False)
+            total -= size
+
+
+def _read_into_memory(file, key, text) -> Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]]:
+    # the disk cache is off: the table and, if text, its coordinate text are parsed in one pass and kept in this process
+    tables, texts = [], []
+    for chunk, data, _ in iter_parsed(file):
+        if not len(chunk):
+            continue
+        if chunk.shape[1] != 4:
+            raise ValueError(f'Expected 4 columns in {file}, found {chunk.shape[1]}')
+        tables.append(chunk)
+        if text:
+            texts.append(text_rows(data, 4))
+    table = np.concatenate(tables) if tables else np.empty((0, 4), dtype=np.float64)
+    _remember(('table', key), table, table.nbytes)
+    if not text:
+        return table, None
+    rows = _text_ends(np.concatenate(texts) if texts else np.empty(0, dtype=np.uint8))
+    _remember(('text', key), rows, rows[0].nbytes + rows[1].nbytes)
+    return table, rows
+
+
+def _touch(path) -> None:
+    try:
+        os.utime(path)  # least recently used entries are evicted first
+    except OSError:
+        pass
+
+
+def load_cached(file) -> Optional[np.ndarray]:
+    # the cached table of a text file with its coordinate text, None if either is missing
+    path = table_path(file)
+    try:
+        table = _open_table(path)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(text_path(file)):
+        return None
+    _touch(path)
+    _touch(text_path(file))
+    return table
+
+
+def _finish(tmp, path) -> None:
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        os.remove(tmp)  # already stored and opened by another worker
+
+
+def store(file) -> np.ndarray:
+    # the rows and their coordinate text are appended as they are parsed, so the file is read only once
+    path = table_path(file)
+    text = text_path(file)
+    os.makedirs(cache_dir(), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    tmp_text = f'{text}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'wb', buffering=CONSTANTS.WRITE_BUFFER) as f, open(tmp_text, 'wb', buffering=CONSTANTS.WRITE_BUFFER) as t:
+            for chunk, data, _ in iter_parsed(file):
+                if not len(chunk):
+                    continue
+                if chunk.shape[1] != 4:
+                    raise ValueError(f'Expected 4 columns in {file}, found {chunk.shape[1]}')
+                np.ascontiguousarray(chunk, dtype=np.float64).tofile(f)
+                text_rows(data, 4).tofile(t)
+    except BaseException:
+        remove_files(tmp, tmp_text)
+        raise
+    _finish(tmp_text, text)
+    _finish(tmp, path)
+    evict(keep=path)
+    return _open_table(path)
+
+
+def store_parts(file, parts, text_parts) -> None:
+    # parts are raw float64 (pressure, X, Y, Z) rows and text_parts their coordinate text,
+    # written by the workers of a split file, in order
+    for path, sources in ((text_path(file), text_parts), (table_path(file), parts)):
+        os.makedirs(cache_dir(), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            for source_name in sources:
+                with open(source_name, 'rb') as source:
+                    shutil.copyfileobj(source, f, CONSTANTS.WRITE_BUFFER)
+        _finish(tmp, path)
+    evict(keep=table_path(file))
+
+
+def _factor_name(index, height_building, width_building, alfa, dzeta10) -> str:
+    params = repr((int(index), float(height_building), float(width_building), float(alfa), float(dzeta10)))
+    return hashlib.blake2b(params.encode(), digest_size=8).hexdigest()
+
+
+def factor_path(file, index, height_building, width_building, alfa, dzeta10) -> str:
+    return os.path.join(cache_dir(), f'{content_key(file)}-{_factor_name(index, height_building, width_building, alfa, dzeta10)}.npy')
+
+
+def load_factor(file, table, index, height_building, width_building, alfa, dzeta10) -> np.ndarray:
+    # the height factor depends only on Z and the building, so changing the dynamic coefficient
+    # or coef_corr reuses it and leaves only the multiplication and the output; it saves ~0.1 s
+    # per million rows, the parsing skipped by the table cache is the bigger part
+    if not cache_enabled():
+        key = ('factor', content_key(file), _factor_name(index, height_building, width_building, alfa, dzeta10))
+        factor = _recall(key)
+        if factor is None or len(factor) != len(table):
+            factor = height_factor(np.asarray(table[:, 3]), index, height_building, width_building, alfa, dzeta10)
+            _remember(key, factor, factor.nbytes)
+        return factor
+    path = factor_path(file, index, height_building, width_building, alfa, dzeta10)
+    try:
+        factor = np.load(path, mmap_mode='r')
+        if len(factor) == len(table):
+            os.utime(path)
+            return factor
+        del factor
+    except (OSError, ValueError):
+        pass
+
+    os.makedirs(cache_dir(), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    factor = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float64, shape=(len(table),))
+    for start in range(0, len(table), CONSTANTS.CHUNK_ROWS):
+        Z = np.array(table[start:start + CONSTANTS.CHUNK_ROWS, 3])
+        factor[start:start + len(Z)] = height_factor(Z, index, height_building, width_building, alfa, dzeta10)
+    factor.flush()
+    del factor
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        os.remove(tmp)  # already stored and opened by another worker
+    evict(keep=path)
+    return np.load(path, mmap_mode='r')
+
+
+def evict(keep=None, limit=None, directory=None, suffixes=('.f8', '.txt', '.npy')) -> None:
+    # the least recently used files are removed until the rest fits into limit, the data cache by default
+    limit = cache_size() if limit is None else limit
+    try:
+        entries = [entry for entry in os.scandir(directory or cache_dir()) if entry.name.endswith(suffixes)]
+    except OSError:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= limit:
+            break
+        if entry.path == keep:
+            continue
+        try:
+            size = entry.stat().st_size
+            os.remove(entry.path)
+            total -= size
+        except OSError:
+            pass  # in use by another worker
+
+
+def load_tables(file, text=True) -> Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]]:
+    # the parsed table of a file and, if text, the coordinate text of its rows with their line ends, both from one parse;
+    # columnar inputs are read as they are, a parsed copy would load no faster, and have no text
+    if table_format(file) is not None:
+        return read_array(file), None
+    key = content_key(file)
+    table = _recall(('table', key))
+    rows = _recall(('text', key)) if text else None
+    if table is not None and (rows is not None or not text):
+        return table, rows
+    if not cache_enabled():
+        return _read_into_memory(file, key, text)
+    table = load_cached(file)
+    if table is None:
+        table = store(file)
+    return table, _open_text(text_path(file)) if text else None
+
+
+def load_table(file) -> np.ndarray:
+    return load_tables(file, False)[0]
+
+
+def cached_lines(text, start, stop) -> List[str]:
+    # the coordinate text of rows start to stop
+    text, ends = text
+    return text_lines(text[ends[start - 1] + 1 if start else 0:ends[stop - 1] + 1 if stop else 0])
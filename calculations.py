@@ -0,0 +1,696 @@
+import os
+import csv
+import math
+import time
+import shutil
+from contextlib import ExitStack
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from cache import cache_enabled, cached_lines, load_cached, load_factor, load_tables, memory_size, store_parts, use_tables
+from columnar import table_columns, table_format
+from constants import CONSTANTS
+from engine import RunningStats, apply_puls, apply_puls_scenarios, calculate_pik, calculate_puls, height_factor
+from fileio import data_size, estimate_rows, file_compression, format_rows, iter_array_chunks, iter_parsed, open_binary_output, open_input, open_table, output_name, split_file, text_lines, text_rows
+from mesh import Mesh, load_mesh, read_with_mesh, scan_file
+from parallel import run_tasks, timed_call
+from progress import Cancelled, Stopwatch, check_cancelled, remove_files
+
+
+PULS_HEADER = ['Puls', 'X(m)', 'Y(m)', 'Z(m)']
+# per-point statistics of transient snapshots, named like the reductions exported by STAR-CCM+
+STATISTICS = {
+    'mean': 'Mean of Pressure (Pa)',
+    'max': 'Max of Pressure (Pa)',
+    'min': 'Min of Pressure (Pa)',
+    'std': 'Standard Deviation of Pressure (Pa)',
+    'peak_max': 'Peak Max of Pressure (Pa)',
+    'peak_min': 'Peak Min of Pressure (Pa)',
+}
+
+
+def table_memory(file) -> int:
+    # a file read into memory while the disk cache is off is held whole
+    return 0 if cache_enabled() or not use_tables(file) else memory_size(file)
+
+
+def puls_cost(file) -> Tuple[int, int]:
+    # (memory, rows): one chunk of split text rows, the cached table path needs less
+    rows = estimate_rows(file)
+    return min(rows, CONSTANTS.CHUNK_ROWS) * 400 + table_memory(file), rows
+
+
+def sweep_cost(file, scenarios) -> Tuple[int, int]:
+    # a chunk plus a result row and its text for every scenario
+    rows = estimate_rows(file)
+    return min(rows, CONSTANTS.CHUNK_ROWS) * (400 + 16 * len(scenarios)) + table_memory(file), rows * len(scenarios)
+
+
+def sort_cost(file) -> Tuple[int, int]:
+    # the parsed table, its order and a chunk being written; external sorts stay within SORT_MEMORY
+    rows = estimate_rows(file)
+    if data_size(file) > CONSTANTS.SORT_MEMORY:
+        return CONSTANTS.SORT_MEMORY, rows
+    return rows * 80, rows
+
+
+def puls_output_name(file, save_dir, compression=CONSTANTS.OUTPUT_COMPRESSION, output_format=CONSTANTS.OUTPUT_FORMAT) -> str:
+    file_name = os.path.basename(file).split('_')[0]
+    return output_name(os.path.join(save_dir, f'{file_name}_puls.csv'), compression, output_format)
+
+
+def write_puls_table(out, file, table, text, factor, dynamic, coef_corr, watch, start=0, stop=None) -> None:
+    # rows start to stop of a cached table, text outputs copy the coordinates from the cached text
+    stop = len(table) if stop is None else stop
+    for begin in range(start, stop, CONSTANTS.CHUNK_ROWS):
+        end = min(begin + CONSTANTS.CHUNK_ROWS, stop)
+        chunk = np.array(table[begin:end])
+        coordinates = [cached_lines(text, begin, end)] if text is not None else list(chunk[:, 1:].T)
+        watch.lap('parse')
+        result = apply_puls(chunk[:, 0], factor[begin:end], dynamic, coef_corr)
+        watch.lap('compute')
+        out.write([result, *coordinates])
+        watch.lap('write')
+        watch.report(file, len(chunk), chunk.nbytes)
+
+
+def block_text(out, chunk, data, cached) -> np.ndarray:
+    # the coordinate text of a parsed block, for a text output or for the cache
+    if data is not None and (out.text or cached):
+        return text_rows(data, chunk.shape[1])
+    return None
+
+
+def write_puls_block(out, chunk, rows, height_building, width_building, index, dynamic, coef_corr, area_data, watch) -> None:
+    # text outputs copy the coordinates from the text of the block
+    coordinates = [text_lines(rows)] if out.text and rows is not None else list(chunk[:, 1:].T)
+    watch.lap('parse')
+    result = calculate_puls(chunk[:, 0], chunk[:, 3], index, height_building, width_building, dynamic, coef_corr, area_data[0], area_data[2])
+    watch.lap('compute')
+    out.write([result, *coordinates])
+    watch.lap('write')
+
+
+def process_file_puls(file, height_building, width_building, index, dynamic, coef_corr, area_data, save_dir, precision=CONSTANTS.CSV_PRECISION, compression=CONSTANTS.OUTPUT_COMPRESSION, output_format=CONSTANTS.OUTPUT_FORMAT) -> str:
+    new_file_name = puls_output_name(file, save_dir, compression, output_format)
+    try:
+        with open_table(new_file_name, PULS_HEADER, ' ', precision, compression, output_format) as out:
+            watch = Stopwatch()
+            if use_tables(file):
+                table, text = load_tables(file, out.text)
+                watch.lap('parse')
+                factor = load_factor(file, table, index, height_building, width_building, area_data[0], area_data[2])
+                watch.lap('compute')
+                write_puls_table(out, file, table, text, factor, dynamic, coef_corr, watch)
+            else:
+                for chunk, data, nbytes in iter_parsed(file):
+                    if len(chunk):
+                        write_puls_block(out, chunk, block_text(out, chunk, data, False), height_building, width_building, index, dynamic, coef_corr, area_data, watch)
+                    watch.report(file, len(chunk), nbytes)
+    except Cancelled:
+        remove_files(new_file_name)
+        raise
+    return new_file_name
+
+
+def process_part_puls(file, part, part_name, height_building, width_building, index, dynamic, coef_corr, area_data, precision=CONSTANTS.CSV_PRECISION, output_format=CONSTANTS.OUTPUT_FORMAT) -> str:
+    # part is ('rows', start, stop) of the cached table or ('bytes', start, end) of the text file;
+    # the parts of columnar outputs are raw float64 rows
+    kind, start, end = part
+    try:
+        with open_table(part_name, None, ' ', precision, None, 'csv' if output_format == 'csv' else 'raw') as out:
+            match kind:
+                case 'rows':
+                    # the factor of the whole file is stored by process_files_puls before the parts start
+                    table, text = load_tables(file, out.text)
+                    factor = load_factor(file, table, index, height_building, width_building, area_data[0], area_data[2])
+                    write_puls_table(out, file, table, text, factor, dynamic, coef_corr, Stopwatch(), start, end)
+                case 'bytes':
+                    with ExitStack() as stack:
+                        # the parsed rows and their text are kept for the cache, which is filled from all parts at once
+                        cached = cache_enabled()
+                        raw = stack.enter_context(open(f'{part_name}.f8', 'wb')) if cached else None
+                        raw_text = stack.enter_context(open(f'{part_name}.txt', 'wb')) if cached else None
+                        watch = Stopwatch()
+                        for chunk, data, nbytes in iter_parsed(file, start, end):
+                            if len(chunk):
+                                rows = block_text(out, chunk, data, cached)
+                                write_puls_block(out, chunk, rows, height_building, width_building, index, dynamic, coef_corr, area_data, watch)
+                            if len(chunk) and raw:
+                                chunk.tofile(raw)
+                                rows.tofile(raw_text)
+                                watch.lap('parse')
+                            watch.report(file, len(chunk), nbytes)
+    except Cancelled:
+        remove_files(part_name, f'{part_name}.f8', f'{part_name}.txt')
+        raise
+    return part_name
+
+
+def plan_parts(file, workers, output_format=CONSTANTS.OUTPUT_FORMAT) -> list:
+    parts = min(workers, math.ceil(data_size(file) / CONSTANTS.SPLIT_SIZE))
+    if parts <= 1 or table_format(file) is not None:
+        return []  # columnar inputs are read whole
+    table = load_cached(file) if cache_enabled() else None
+    if table is not None:
+        bounds = np.linspace(0, len(table), parts + 1).astype(int).tolist()
+        return [('rows', start, stop) for start, stop in zip(bounds, bounds[1:])]
+    if file_compression(file):
+        return []  # a compressed stream cannot be entered in the middle
+    return [('bytes', start, end) for start, end in split_file(file, parts)]
+
+
+def join_parts(file_name, header, delimiter, parts, output_format=CONSTANTS.OUTPUT_FORMAT) -> None:
+    if output_format != 'csv':
+        with open_table(file_name, header, delimiter, output_format=output_format) as out:
+            for part in parts:
+                if os.path.getsize(part):
+                    rows = np.memmap(part, dtype=np.float64, mode='r').reshape(-1, len(header))
+                    for start in range(0, len(rows), CONSTANTS.CHUNK_ROWS):
+                        out.write(list(rows[start:start + CONSTANTS.CHUNK_ROWS].T))
+                    del rows
+                os.remove(part)
+        return
+    with open_binary_output(file_name) as f:
+        f.write((delimiter.join(header) + '\r\n').encode())
+        for part in parts:
+            with open(part, 'rb') as p:
+                shutil.copyfileobj(p, f, CONSTANTS.WRITE_BUFFER)
+            os.remove(part)
+
+
+def process_files_puls(files, height_building, width_building, index, dynamic, coef_corr, area_data, save_dir, backend, workers, precision=CONSTANTS.CSV_PRECISION, compression=CONSTANTS.OUTPUT_COMPRESSION, output_format=CONSTANTS.OUTPUT_FORMAT, job=None) -> List[Tuple[str, str, float]]:
+    # large files are split into parts so that a single file uses all workers
+    tasks = []
+    costs = []
+    plans = []
+    for file in files:
+        new_file_name = puls_output_name(file, save_dir, compression, output_format)
+        parts = plan_parts(file, workers, output_format)
+        if parts and parts[0][0] == 'rows':
+            load_factor(file, load_cached(file), index, height_building, width_building, area_data[0], area_data[2])
+        if parts:
+            part_names = [f'{new_file_name}.part{i}' for i in range(len(parts))]
+            tasks += [(process_part_puls, file, part, part_name, height_building, width_building, index, dynamic, coef_corr, area_data, precision, output_format) for part, part_name in zip(parts, part_names)]
+            memory, rows = puls_cost(file)
+            costs += [(memory, rows // len(parts))] * len(parts)
+        else:
+            part_names = []
+            tasks.append((process_file_puls, file, height_building, width_building, index, dynamic, coef_corr, area_data, save_dir, precision, compression, output_format))
+            costs.append(puls_cost(file))
+        plans.append((file, new_file_name, part_names))
+
+    try:
+        results = iter(run_tasks(timed_call, tasks, backend, workers, job, costs))
+    except Cancelled:
+        for _, _, part_names in plans:
+            remove_files(*part_names, *[f'{part_name}.f8' for part_name in part_names], *[f'{part_name}.txt' for part_name in part_names])
+        raise
+
+    timings = []
+    for file, new_file_name, part_names in plans:
+        if not part_names:
+            _, seconds = next(results)
+            timings.append((file, new_file_name, seconds))
+            continue
+        seconds = sum(next(results)[1] for _ in part_names)
+        start = time.perf_counter()
+        join_parts(new_file_name, PULS_HEADER, ' ', part_names, output_format)
+        raw_parts = [f'{part_name}.f8' for part_name in part_names]
+        text_parts = [f'{part_name}.txt' for part_name in part_names]
+        if all(os.path.exists(raw_part) for raw_part in raw_parts + text_parts):
+            store_parts(file, raw_parts, text_parts)
+        remove_files(*raw_parts, *text_parts)
+        timings.append((file, new_file_name, seconds + time.perf_counter() - start))
+    return timings
+
+
+def process_file_sweep(file, height_building, width_building, index, scenarios, coef_corr, save_dir, precision=CONSTANTS.CSV_PRECISION, compression=CONSTANTS.OUTPUT_COMPRESSION, output_format=CONSTANTS.OUTPUT_FORMAT) -> List[str]:
+    # the file is read once, every scenario is written to <save_dir>/<scenario name>/<name>_puls.csv
+    new_file_names = [puls_output_name(file, os.path.join(save_dir, name), compression, output_format) for name, _, _ in scenarios]
+    areas = list({tuple(area_data): None for _, area_data, _ in scenarios})
+    which = [areas.index(tuple(area_data)) for _, area_data, _ in scenarios]
+    dynamics = [dynamic for _, _, dynamic in scenarios]
+    watch = Stopwatch()
+    try:
+        with ExitStack() as stack:
+            outputs = []
+            for new_file_name in new_file_names:
+                os.makedirs(os.path.dirname(new_file_name), exist_ok=True)
+                outputs.append(stack.enter_context(open_table(new_file_name, PULS_HEADER, ' ', precision, compression, output_format)))
+            if use_tables(file):
+                table, text = load_tables(file, outputs[0].text)
+                watch.lap('parse')
+                factors = [load_factor(file, table, index, height_building, width_building, alfa, dzeta10) for alfa, _, dzeta10 in areas]
+                watch.lap('compute')
+                for start in range(0, len(table), CONSTANTS.CHUNK_ROWS):
+                    chunk = np.array(table[start:start + CONSTANTS.CHUNK_ROWS])
+                    coordinates = [cached_lines(text, start, start + len(chunk))] if text is not None else list(chunk[:, 1:].T)
+                    watch.lap('parse')
+                    results = apply_puls_scenarios(chunk[:, 0], np.stack([factor[start:start + len(chunk)] for factor in factors]), which, dynamics, coef_corr)
+                    watch.lap('compute')
+                    for out, result in zip(outputs, results):
+                        out.write([result, *coordinates])
+                    watch.lap('write')
+                    watch.report(file, len(chunk), chunk.nbytes)
+            else:
+                for chunk, data, nbytes in iter_parsed(file):
+                    if len(chunk):
+                        if not outputs[0].text:
+                            coordinates = list(chunk[:, 1:].T)
+                        elif data is not None:
+                            coordinates = [text_lines(text_rows(data, chunk.shape[1]))]
+                        else:
+                            coordinates = [format_rows(list(chunk[:, 1:].T), ' ', precision)]
+                        watch.lap('parse')
+                        factors = np.stack([height_factor(chunk[:, 3], index, height_building, width_building, alfa, dzeta10) for alfa, _, dzeta10 in areas])
+                        results = apply_puls_scenarios(chunk[:, 0], factors, which, dynamics, coef_corr)
+                        watch.lap('compute')
+                        for out, result in zip(outputs, results):
+                            out.write([result, *coordinates])
+                        watch.lap('write')
+                    watch.report(file, len(chunk), nbytes)
+    except Cancelled:
+        remove_files(*new_file_names)
+        raise
+    return new_file_names
+
+
+def process_files_sweep(files, height_building, width_building, index, scenarios, coef_corr, save_dir, backend, workers, precision=CONSTANTS.CSV_PRECISION, compression=CONSTANTS.OUTPUT_COMPRESSION, output_format=CONSTANTS.OUTPUT_FORMAT, job=None) -> List[Tuple[str, List[str], float]]:
+    tasks = [(process_file_sweep, file, height_building, width_building, index, scenarios, coef_corr, save_dir, precision, compression, output_format) for file in files]
+    results = run_tasks(timed_call, tasks, backend, workers, job, [sweep_cost(file, scenarios) for file in files])
+    return [(file, new_file_names, seconds) for file, (new_file_names, seconds) in zip(files, results)]
+
+
+def process_row_puls(row, index, height_building, width_building, dynamic, coef_corr, alfa, dzeta10) -> List[str]:
+    X, Y, Z = row[1], row[2], row[3]
+    pressure = float(row[0])
+    dimension = height_building - width_building
+    match index:
+        case 1:
+            result = pressure * (dzeta10 * pow(height_building / 10, -alfa)) * dynamic * coef_corr + pressure
+        case 2:
+            if float(Z) >= dimension:
+                result = pressure * (dzeta10 * pow(height_building / 10, -alfa)) * dynamic * coef_corr + pressure
+            else:
+                result = pressure * (dzeta10 * pow(width_building / 10, -alfa)) * dynamic * coef_corr + pressure
+        case 3:
+            if float(Z) >= dimension:
+                result = pressure * (dzeta10 * pow(height_building / 10, -alfa)) * dynamic * coef_corr + pressure
+            else:
+                if float(Z) <= width_building:
+                    result = pressure * (dzeta10 * pow(width_building / 10, -alfa)) * dynamic * coef_corr + pressure
+                else:
+                    result = pressure * (dzeta10 * pow(float(Z) / 10, -alfa)) * dynamic * coef_corr + pressure
+    new_row = [str(result), X, Y, Z]
+    return new_row
+
+
+def read_header(file) -> List[str]:
+    # STAR-CCM+ exports are tab separated, older ones space separated with quoted column names
+    if table_format(file) is not None:
+        return table_columns(file)
+    with open_input(file, 'r', newline='') as f:
+        line = f.readline().rstrip('\r\n')
+    return line.split('\t') if '\t' in line else next(csv.reader([line], delimiter=' ', skipinitialspace=True))
+
+
+def sorted_order(file, watch) -> Tuple[np.ndarray, np.ndarray]:
+    # the (P, X, Y, Z) table and the order of its rows by (X, Y, Z), a stable sort keeps equal coordinates in file order;
+    # the order is that of the mesh, so files on a cached mesh only have their pressures parsed
+    pressure, mesh = read_with_mesh(file)
+    table = np.column_stack((pressure, mesh.xyz))
+    watch.lap('parse')
+    check_cancelled()
+    order = mesh.order
+    watch.lap('sort')
+    check_cancelled()
+    return table, order
+
+
+def sort_in_memory(file, watch) -> Iterator[np.ndarray]:
+    table, order = sorted_order(file, watch)
+    watch.report(file, len(table), data_size(file))
+    for start in range(0, len(order), CONSTANTS.CHUNK_ROWS):
+        yield table[order[start:start + CONSTANTS.CHUNK_ROWS]]
+
+
+def rows_up_to(block, bound) -> int:
+    # number of leading rows of a block sorted by (X, Y, Z, row) that are not greater than bound
+    X = block[:, 1]
+    low = int(np.searchsorted(X, bound[0], 'left'))
+    high = int(np.searchsorted(X, bound[0], 'right'))
+    Y, Z, R = block[low:high, 2], block[low:high, 3], block[low:high, 4]
+    mask = (Y < bound[1]) | ((Y == bound[1]) & ((Z < bound[2]) | ((Z == bound[2]) & (R <= bound[3]))))
+    return low + int(np.count_nonzero(mask))
+
+
+def merge_runs(runs, watch) -> Iterator[np.ndarray]:
+    # every batch takes from all runs the rows up to the smallest last key of the loaded blocks,
+    # so the batch can be sorted and handed on without looking further into any run
+    block_rows = max(CONSTANTS.SORT_MEMORY // (len(runs) * 5 * 8 * 4), 1000)
+    positions = [0] * len(runs)
+    while any(position < len(run) for run, position in zip(runs, positions)):
+        blocks = [run[position:position + block_rows] for run, position in zip(runs, positions)]
+        unfinished = [block for block, run, position in zip(blocks, runs, positions) if position + len(block) < len(run)]
+        bound = min(tuple(block[-1, 1:].tolist()) for block in unfinished) if unfinished else None
+        taken = []
+        for i, block in enumerate(blocks):
+            count = len(block) if bound is None else rows_up_to(block, bound)
+            taken.append(block[:count])
+            positions[i] += count
+        batch = np.concatenate(taken)
+        watch.lap('parse')
+        batch = batch[np.lexsort((batch[:, 4], batch[:, 3], batch[:, 2], batch[:, 1]))]
+        watch.lap('sort')
+        yield batch[:, :4]
+
+
+def sort_external(file, watch) -> Iterator[np.ndarray]:
+    # runs that fit into SORT_MEMORY are sorted and spilled next to the input, then merged
+    run_rows = max(CONSTANTS.SORT_MEMORY // 256, 1000)
+    run_dir = f'{file}.{os.getpid()}.runs'
+    os.makedirs(run_dir, exist_ok=True)
+    runs = []
+    try:
+        row = 0
+        for chunk, nbytes in iter_array_chunks(file, chunk_rows=run_rows):
+            # the row number keeps equal coordinates in file order, as the in-memory sort does
+            run = np.column_stack((chunk[:, :4], np.arange(row, row + len(chunk), dtype=np.float64)))
+            row += len(chunk)
+            watch.lap('parse')
+            run = run[np.lexsort((run[:, 3], run[:, 2], run[:, 1]))]
+            watch.lap('sort')
+            run_name = os.path.join(run_dir, f'{len(runs)}.npy')
+            np.save(run_name, run)
+            del run
+            runs.append(np.load(run_name, mmap_mode='r'))
+            watch.lap('write')
+            watch.report(file, len(chunk), nbytes)
+        if runs:
+            yield from merge_runs(runs, watch)
+    finally:
+        runs.clear()  # memory maps are closed before the files are removed
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def iter_sorted(file, watch) -> Iterator[np.ndarray]:
+    # blocks of (P, X, Y, Z) rows in the order of (X, Y, Z)
+    if data_size(file) > CONSTANTS.SORT_MEMORY:
+        return sort_external(file, watch)
+    return sort_in_memory(file, watch)
+
+
+def sort_files(file, precision=CONSTANTS.CSV_PRECISION) -> None:
+    # the pressure is the first column whatever its name (Max/Min of Pressure), all columns are parsed as float64
+    watch = Stopwatch()
+    header = read_header(file)
+
+    # the input is replaced only once the sorted copy is complete, compressed or columnar as it was
+    tmp_file = f'{file}.{os.getpid()}.tmp'
+    try:
+        with open_table(tmp_file, header, '\t', precision, file_compression(file), table_format(file) or 'csv') as out:
+            for block in iter_sorted(file, watch):
+                out.write(list(block.T))
+                watch.lap('write')
+                watch.report(file)
+        os.replace(tmp_file, file)
+    finally:
+        remove_files(tmp_file)
+
+
+def process_files_sort(files, backend, workers, job=None) -> List[Tuple[str, float]]:
+    tasks = [(sort_files, file) for file in files]
+    results = run_tasks(timed_call, tasks, backend, workers, job, [sort_cost(file) for file in files])
+    return [(file, seconds) for file, (_, seconds) in zip(files, results)]
+
+
+def sort_rows(file, spill_name) -> np.ndarray | str:
+    # the sorted rows of a file for the envelope; larger than SORT_MEMORY they are spilled as raw float64
+    # to spill_name and the name is returned instead
+    watch = Stopwatch()
+    if data_size(file) <= CONSTANTS.SORT_MEMORY:
+        table, order = sorted_order(file, watch)
+        table = table[order]
+        watch.lap('sort')
+        watch.report(file, len(table), data_size(file))
+        return table
+    try:
+        with open(spill_name, 'wb') as f:
+            for block in sort_external(file, watch):
+                np.ascontiguousarray(block).tofile(f)
+                watch.lap('write')
+                watch.report(file)
+    except BaseException:
+        remove_files(spill_name)
+        raise
+    return spill_name
+
+
+def detect_processing_type(file) -> str:
+    if 'max' in file:
+        return 'max'
+    elif 'min' in file:
+        return 'min'
+    raise ValueError(f'Cannot tell max from min by file name: {file}')
+
+
+def envelope_files_sorted(files, processing_type, height_building, width_building, index, coef_corr, area_data, save_dir, backend, workers, precision=CONSTANTS.CSV_PRECISION, compression=CONSTANTS.OUTPUT_COMPRESSION, output_format=CONSTANTS.OUTPUT_FORMAT, job=None) -> str:
+    # the files are sorted in the workers and every sorted table is folded into the envelope as soon as
+    # it arrives, the inputs are not rewritten; the result is that of sorting the files and taking the max/min row by row
+    alfa = area_data[0]
+    dzeta10 = area_data[2]
+    better = np.greater if processing_type == 'max' else np.less
+
+    file_name = output_name(os.path.join(save_dir, f'{processing_type}.csv'), compression, output_format)
+    spill_dir = os.path.join(save_dir, f'.{processing_type}.{os.getpid()}.sort')
+    os.makedirs(spill_dir, exist_ok=True)
+    envelope = {}
+
+    def fold(i, rows) -> None:
+        watch = Stopwatch()
+        spill_name = rows if isinstance(rows, str) else None
+        if spill_name is not None:
+            rows = np.memmap(spill_name, dtype=np.float64, mode='r').reshape(-1, 4)
+        try:
+            if not envelope and len(rows) * 36 > CONSTANTS.SORT_MEMORY:
+                # the envelope stays on disk next to the spilled runs and is filled chunk by chunk
+                envelope['rows'] = np.lib.format.open_memmap(os.path.join(spill_dir, 'envelope.npy'), 'w+', np.float64, rows.shape)
+                envelope['file'] = np.lib.format.open_memmap(os.path.join(spill_dir, 'owner.npy'), 'w+', np.int32, (len(rows),))
+                for start in range(0, len(rows), CONSTANTS.CHUNK_ROWS):
+                    envelope['rows'][start:start + CONSTANTS.CHUNK_ROWS] = rows[start:start + CONSTANTS.CHUNK_ROWS]
+                envelope['file'][:] = i
+            elif not envelope:
+                envelope['rows'] = np.array(rows)
+                envelope['file'] = np.full(len(rows), i, dtype=np.int32)
+            elif len(rows) != len(envelope['rows']):
+                raise ValueError('Input files have different number of rows')
+            else:
+                for start in range(0, len(rows), CONSTANTS.CHUNK_ROWS):
+                    block = rows[start:start + CONSTANTS.CHUNK_ROWS]
+                    best = envelope['rows'][start:start + CONSTANTS.CHUNK_ROWS]
+                    owner = envelope['file'][start:start + CONSTANTS.CHUNK_ROWS]
+                    # argmax/argmin take the first file on ties, the files arrive in any order
+                    take = better(block[:, 0], best[:, 0]) | ((block[:, 0] == best[:, 0]) & (owner > i))
+                    best[take] = block[take]
+                    owner[take] = i
+            watch.lap('compute')
+            watch.send(files[i])
+        finally:
+            if spill_name is not None:
+                del rows
+                remove_files(spill_name)
+
+    # the envelope of 36 bytes a row is held in memory up to SORT_MEMORY
+    costs = [(sort_cost(file)[0] + min(estimate_rows(file) * 36, CONSTANTS.SORT_MEMORY), estimate_rows(file)) for file in files]
+    tasks = [(file, os.path.join(spill_dir, f'{i}.f8')) for i, file in enumerate(files)]
+    try:
+        run_tasks(sort_rows, tasks, backend, workers, job, costs, fold)
+        watch = Stopwatch()
+        with open_table(file_name, [f'{processing_type.capitalize()}', 'X(m)', 'Y(m)', 'Z(m)'], '\t', precision, compression, output_format) as out:
+            for start in range(0, len(envelope['rows']), CONSTANTS.CHUNK_ROWS):
+                chunk = np.array(envelope['rows'][start:start + CONSTANTS.CHUNK_ROWS])
+                chunk[:, 0] = calculate_pik(chunk[:, 0], chunk[:, 3], index, height_building, width_building, coef_corr, alfa, dzeta10)
+                watch.lap('compute')
+                out.write(list(chunk.T))
+                watch.lap('write')
+                # the rows were counted as the workers sorted them
+                watch.report(file_name)
+    except Cancelled:
+        remove_files(file_name)
+        raise
+    finally:
+        envelope.clear()  # an envelope on disk is closed before its directory is removed
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return file_name
+
+
+def envelope_files_keyed(files, processing_type, height_building, width_building, index, coef_corr, area_data, save_dir, tolerance=CONSTANTS.COORD_TOLERANCE, precision=CONSTANTS.CSV_PRECISION, compression=CONSTANTS.OUTPUT_COMPRESSION, output_format=CONSTANTS.OUTPUT_FORMAT) -> int:
+    alfa = area_data[0]
+    dzeta10 = area_data[2]
+    select = np.maximum if processing_type == 'max' else np.minimum
+
+    watch = Stopwatch()
+    envelope, mesh = read_with_mesh(files[0])
+    watch.lap('parse')
+    watch.report(files[0], len(mesh), data_size(files[0]))
+    seen = np.ones(len(mesh), dtype=np.int32)
+    extra = []
+    for file in files[1:]:
+        pressure, file_mesh = read_with_mesh(file)
+        watch.lap('parse')
+        if file_mesh.fingerprint == mesh.fingerprint:
+            # same points in the same order, no lookup needed
+            envelope = select(envelope, pressure)
+            seen += 1
+        else:
+            found = mesh.points(tolerance).lookup(file_mesh.xyz)
+            matched = found >= 0
+            found = found[matched]
+            # points repeated in a file all count, not only the last one
+            select.at(envelope, found, pressure[matched])
+            seen[found] += 1
+            if not matched.all():
+                extra.append((os.path.basename(file), file_mesh.xyz[~matched]))
+        watch.lap('compute')
+        watch.report(file, len(pressure), data_size(file))
+
+    reference = np.column_stack((envelope, mesh.xyz))
+    reference[:, 0] = calculate_pik(envelope, reference[:, 3], index, height_building, width_building, coef_corr, alfa, dzeta10)
+    watch.lap('compute')
+    file_name = output_name(os.path.join(save_dir, f'{processing_type}.csv'), compression, output_format)
+    with open_table(file_name, [f'{processing_type.capitalize()}', 'X(m)', 'Y(m)', 'Z(m)'], '\t', precision, compression, output_format) as out:
+        out.write(list(reference.T))
+    watch.lap('write')
+    watch.send(file_name)
+
+    # points of the first file absent from some files are reported as "found/total",
+    # points absent from the first file are reported with the name of the file they came from
+    incomplete = np.flatnonzero(seen < len(files))
+    missing = incomplete.size + sum(len(xyz) for _, xyz in extra)
+    if missing:
+        report_name = os.path.join(save_dir, f'{processing_type}_missing.csv')
+        with open(report_name, 'w', newline='') as f:
+            writer = csv.writer(f, delimiter='\t')
+            writer.writerow(['Found in', 'X(m)', 'Y(m)', 'Z(m)'])
+            for count, xyz in zip(seen[incomplete].tolist(), reference[incomplete, 1:].tolist()):
+                writer.writerow([f'{count}/{len(files)}', *xyz])
+            for name, xyz in extra:
+                writer.writerows([name, *row] for row in xyz.tolist())
+    return missing
+
+
+def read_snapshot(file, first) -> Tuple[np.ndarray, Mesh | str]:
+    # the pressure of one time step with the mesh for the first snapshot, only the mesh fingerprint for the others
+    watch = Stopwatch()
+    pressure, mesh = read_with_mesh(file) if first else scan_file(file)
+    watch.lap('parse')
+    watch.report(file, len(pressure), data_size(file))
+    return pressure, mesh
+
+
+def snapshot_statistics(files, backend, workers, tolerance=CONSTANTS.COORD_TOLERANCE, epochs=0, job=None) -> Tuple[RunningStats, Mesh]:
+    # mean, max, min and std per point of the first snapshot's mesh in one pass over per-timestep snapshots
+    # in time order, with epochs also the extremes of every epoch for the peak estimates; the snapshots are
+    # parsed in the workers and added in file order, so the result does not depend on the order they finish in,
+    # snapshots with the points in another order are matched by coordinates
+    if not files:
+        raise ValueError('No snapshots given')
+    state = {'next': 0}
+    pending = {}
+
+    def align(i, pressure, fingerprint) -> np.ndarray:
+        mesh = state['mesh']
+        if fingerprint == mesh.fingerprint:
+            return pressure
+        found = mesh.points(tolerance).lookup(load_mesh(files[i], fingerprint).xyz)
+        covered = np.zeros(len(mesh), dtype=bool)
+        covered[found[found >= 0]] = True
+        if len(found) != len(mesh) or (found < 0).any() or not covered.all():
+            raise ValueError(f'Snapshot {files[i]} is not on the mesh of {files[0]}')
+        aligned = np.empty(len(mesh))
+        aligned[found] = pressure
+        return aligned
+
+    def fold(i, result) -> None:
+        pending[i] = result
+        while state['next'] in pending:
+            watch = Stopwatch()
+            j = state['next']
+            pressure, scanned = pending.pop(j)
+            if j == 0:
+                state['mesh'] = scanned
+                state['stats'] = RunningStats(len(scanned), len(files), epochs)
+            else:
+                pressure = align(j, pressure, scanned)
+            state['stats'].add(pressure)
+            state['next'] += 1
+            watch.lap('compute')
+            watch.send(files[j])
+
+    # the pressure of a snapshot is returned to this thread and kept until the snapshots before it are added
+    costs = [(min(rows, CONSTANTS.CHUNK_ROWS) * 400 + rows * (40 if i == 0 else 16), rows) for i, rows in enumerate(estimate_rows(file) for file in files)]
+    run_tasks(read_snapshot, [(file, i == 0) for i, file in enumerate(files)], backend, workers, job, costs, fold)
+    return state['stats'], state['mesh']
+
+
+def write_points(file_name, header, delimiter, values, xyz, precision, compression, output_format) -> str:
+    watch = Stopwatch()
+    try:
+        with open_table(file_name, header, delimiter, precision, compression, output_format) as out:
+            for start in range(0, len(values), CONSTANTS.CHUNK_ROWS):
+                out.write([values[start:start + CONSTANTS.CHUNK_ROWS], *xyz[start:start + CONSTANTS.CHUNK_ROWS].T])
+                watch.lap('write')
+                watch.report(file_name)
+    except Cancelled:
+        remove_files(file_name)
+        raise
+    return file_name
+
+
+def statistic_values(stats, fractile=CONSTANTS.PEAK_FRACTILE) -> dict:
+    values = {'mean': stats.mean, 'max': stats.max, 'min': stats.min, 'std': stats.std()}
+    if stats.epochs:
+        values['peak_max'], values['peak_min'] = stats.peaks(fractile)
+    return values
+
+
+def write_statistics(values, xyz, save_dir, name='transient', precision=CONSTANTS.CSV_PRECISION, compression=CONSTANTS.OUTPUT_COMPRESSION, output_format=CONSTANTS.OUTPUT_FORMAT) -> dict:
+    # <name>_mean.csv, <name>_max.csv, ... in the layout of the exported reductions,
+    # so they are also inputs of the pulsation and peak calculations
+    return {
+        statistic: write_points(output_name(os.path.join(save_dir, f'{name}_{statistic}.csv'), compression, output_format), [STATISTICS[statistic], 'X(m)', 'Y(m)', 'Z(m)'], '\t', column, xyz, precision, compression, output_format)
+        for statistic, column in values.items()
+    }
+
+
+def process_snapshots(files, height_building, width_building, index, dynamic, coef_corr_puls, coef_corr_pik, area_data, save_dir, backend, workers, name='transient', tolerance=CONSTANTS.COORD_TOLERANCE, precision=CONSTANTS.CSV_PRECISION, compression=CONSTANTS.OUTPUT_COMPRESSION, output_format=CONSTANTS.OUTPUT_FORMAT, epochs=0, job=None) -> List[str]:
+    # the statistics of the snapshots, the pulsation of the mean (<name>_puls.csv) unless dynamic is None and
+    # the peaks (max.csv, min.csv) unless coef_corr_pik is None, all from the arrays in memory; the peaks are
+    # the max and min over all snapshots, or with epochs their Gumbel estimates (<name>_peak_max, _peak_min).
+    # The results equal those of the other calculations run on the written statistics
+    alfa = area_data[0]
+    dzeta10 = area_data[2]
+    stats, mesh = snapshot_statistics(files, backend, workers, tolerance, epochs, job)
+    watch = Stopwatch()
+    values = statistic_values(stats)
+    watch.lap('compute')
+    watch.send(files[0])
+    outputs = list(write_statistics(values, mesh.xyz, save_dir, name, precision, compression, output_format).values())
+    Z = mesh.xyz[:, 2]
+    if dynamic is not None:
+        watch = Stopwatch()
+        puls = calculate_puls(stats.mean, Z, index, height_building, width_building, dynamic, coef_corr_puls, alfa, dzeta10)
+        watch.lap('compute')
+        watch.send(files[0])
+        outputs.append(write_points(output_name(os.path.join(save_dir, f'{name}_puls.csv'), compression, output_format), PULS_HEADER, ' ', puls, mesh.xyz, precision, compression, output_format))
+    if coef_corr_pik is not None:
+        for processing_type in ('max', 'min'):
+            watch = Stopwatch()
+            envelope = values[f'peak_{processing_type}' if epochs else processing_type]
+            pik = calculate_pik(envelope, Z, index, height_building, width_building, coef_corr_pik, alfa, dzeta10)
+            watch.lap('compute')
+            watch.send(files[0])
+            outputs.append(write_points(output_name(os.path.join(save_dir, f'{processing_type}.csv'), compression, output_format), [f'{processing_type.capitalize()}', 'X(m)', 'Y(m)', 'Z(m)'], '\t', pik, mesh.xyz, precision, compression, output_format))
+    return outputs
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import argparse
+from functools import partial
+from multiprocessing import freeze_support
+
+from calculations import detect_processing_type, envelope_files_keyed, envelope_files_sorted, process_files_puls, process_files_sweep, process_snapshots
+from coefficients import building_index, calculate_dynamic, calculate_e1, calculate_zet, sweep_scenarios
+from constants import CONSTANTS
+from fileio import output_name
+from parallel import timed_call
+from profiling import profiled, write_report
+from progress import Cancelled, Job
+
+
+# Batch job file (JSON):
+# {
+#     "save_dir": "results",
+#     "jobs": [
+#         {"calculation": "puls", "files": ["1_mean.csv", "2_mean.csv"], "height": 120, "width": 40,
+#          "area_type": "B", "wind_area": "2 (СПб)", "frequency": 0.45, "decrement": "0.3"},
+#         {"calculation": "pik", "files": ["1_max.csv", "2_max.csv"], "height": 120, "width": 40, "coef_corr": 1},
+#         {"calculation": "sweep", "files": ["1_mean.csv"], "height": 120, "width": 40, "frequency": 0.45,
+#          "area_types": ["A", "B", "C"], "wind_areas": ["1 (Мск)", "2 (СПб)", "350"], "decrements": ["0.3", "0.15"]},
+#         {"calculation": "transient", "files": ["p_0001.csv", "p_0002.csv", "p_0003.csv"], "height": 120, "width": 40,
+#          "name": "run1", "coef_corr": 1, "coef_corr_pik": 1, "epochs": 10}
+#     ]
+# }
+# Keys missing from a job are taken from the top level of the file, then from the GUI defaults.
+# Inputs can be gzip or zstd compressed (.csv.gz, .csv.zst); "compress": "gz" or "zst" compresses the outputs.
+# "output_format": "npz", "parquet" or "arrow" writes compressed columnar outputs instead of CSV (parquet and arrow
+# need pyarrow); such files, like .npz/.parquet/.arrow tables made by other scripts, are also read as inputs.
+# "transient" takes per-timestep pressure snapshots instead of the reductions exported by STAR-CCM+: it writes
+# <name>_mean, _max, _min and _std and from them the pulsation (<name>_puls) and the peaks (max, min).
+# "epochs": N estimates the peaks by a Gumbel fit to the extremes of N equal parts of the record (Cook-Mayne)
+# instead of taking the max and min over all snapshots, they are also written as <name>_peak_max and _peak_min.
+#
+# --profile DIR (or the MMTT_PROFILE environment variable) writes a JSON report with wall time, CPU time,
+# peak memory and row counts per stage and file for every job; --cprofile adds cProfile dumps per task.
+
+DEFAULTS = {
+    'area_type': 'A',
+    'wind_area': list(CONSTANTS.WIND_AREA.keys())[1],
+    'wind_pressure': None,
+    'frequency': None,
+    'decrement': CONSTANTS.DECREMENT[0],
+    'join': CONSTANTS.JOIN_MODES.get(list(CONSTANTS.JOIN_MODES.keys())[0]),
+    'backend': CONSTANTS.BACKENDS.get(list(CONSTANTS.BACKENDS.keys())[0]),
+    'workers': os.cpu_count() or 1,
+    'save_dir': '.',
+    'precision': CONSTANTS.CSV_PRECISION,
+    'compress': CONSTANTS.OUTPUT_COMPRESSION,
+    'output_format': CONSTANTS.OUTPUT_FORMAT,
+    'area_types': list(CONSTANTS.AREA_TYPES.keys()),
+    'wind_areas': None,
+    'decrements': CONSTANTS.DECREMENT,
+    'name': 'transient',
+    'epochs': 0,
+}
+
+
+class JobError(Exception):
+    pass
+
+
+def get_dynamic(job, area_data) -> float:
+    if not job['frequency']:
+        return 1
+    pressure = job['wind_pressure'] or CONSTANTS.WIND_AREA.get(job['wind_area'])
+    if not pressure:
+        raise JobError(f'Неизвестное давление для ветрового района: {job["wind_area"]}')
+    zet = calculate_zet(float(job['height']), area_data[0], area_data[1])
+    e1 = calculate_e1(float(pressure), zet, float(job['frequency']))
+    dynamic = calculate_dynamic(e1, str(job['decrement']))
+    if not dynamic:
+        raise JobError('Не рассчитан коэффициент динамичности')
+    return dynamic
+
+
+def run_job(job) -> None:
+    job = {**DEFAULTS, **job}
+    files = job.get('files')
+    if not files:
+        raise JobError('Нет файлов для расчёта')
+    if not all([job.get('height'), job.get('width')]):
+        raise JobError('Отсутствуют размеры здания')
+    area_data = CONSTANTS.AREA_TYPES.get(job['area_type'])
+    if area_data is None:
+        raise JobError(f'Неизвестный тип местности: {job["area_type"]}')
+
+    height_building = float(job['height'])
+    width_building = float(job['width'])
+    index = building_index(height_building, width_building)
+    save_dir = job['save_dir']
+    os.makedirs(save_dir, exist_ok=True)
+    progress = Job(job['backend'])
+    try:
+        run_calculation(job, files, height_building, width_building, index, area_data, save_dir, progress)
+    finally:
+        report = write_report(progress, job.get('calculation'), job)
+        if report:
+            print(f'Отчёт профилирования: {report}')
+
+
+def run_calculation(job, files, height_building, width_building, index, area_data, save_dir, progress) -> None:
+    match job.get('calculation'):
+        case 'puls':
+            if 'mean' not in files[0]:
+                raise JobError('Похоже, исходные файлы для другого расчёта')
+            dynamic = get_dynamic(job, area_data)
+            coef_corr = float(job.get('coef_corr', CONSTANTS.COEF_SPATIAL_CORR_PULS))
+            results = process_files_puls(files, height_building, width_building, index, dynamic, coef_corr, area_data, save_dir, job['backend'], job['workers'], job['precision'], job['compress'], job['output_format'], progress)
+            for file, output, seconds in results:
+                print(f'{file} -> {output}: {seconds:.2f} с')
+            print(progress.summary())
+        case 'sweep':
+            if 'mean' not in files[0]:
+                raise JobError('Похоже, исходные файлы для другого расчёта')
+            unknown = [area_type for area_type in job['area_types'] if area_type not in CONSTANTS.AREA_TYPES]
+            if unknown:
+                raise JobError(f'Неизвестный тип местности: {", ".join(unknown)}')
+            wind_areas = job['wind_areas'] or [str(job['wind_pressure'] or job['wind_area'])]
+            scenarios = sweep_scenarios(height_building, job['area_types'], wind_areas, [str(decrement) for decrement in job['decrements']], job['frequency'] and float(job['frequency']))
+            coef_corr = float(job.get('coef_corr', CONSTANTS.COEF_SPATIAL_CORR_PULS))
+            results = process_files_sweep(files, height_building, width_building, index, scenarios, coef_corr, save_dir, job['backend'], job['workers'], job['precision'], job['compress'], job['output_format'], progress)
+            for file, outputs, seconds in results:
+                print(f'{file} -> {len(outputs)} вариантов: {seconds:.2f} с')
+            print(f'Варианты: {", ".join(name for name, _, _ in scenarios)}')
+            print(progress.summary())
+        case 'pik':
+            if 'mean' in files[0]:
+                raise JobError('Похоже, исходные файлы для другого расчёта')
+            coef_corr = float(job.get('coef_corr', CONSTANTS.COEF_SPATIAL_CORR_PIK))
+            processing_type = detect_processing_type(files[0])
+            progress.connect()
+            match job['join']:
+                case 'sorted':
+                    output, seconds = timed_call(envelope_files_sorted, files, processing_type, height_building, width_building, index, coef_corr, area_data, save_dir, job['backend'], job['workers'], job['precision'], job['compress'], job['output_format'], progress)
+                case 'keyed':
+                    missing, seconds = profiled(partial(timed_call, envelope_files_keyed))(files, processing_type, height_building, width_building, index, coef_corr, area_data, save_dir, CONSTANTS.COORD_TOLERANCE, job['precision'], job['compress'], job['output_format'])
+                    output = output_name(os.path.join(save_dir, f'{processing_type}.csv'), job['compress'], job['output_format'])
+                    if missing:
+                        print(f'Точек без совпадений: {missing} (см. {processing_type}_missing.csv)')
+                case _:
+                    raise JobError(f'Неизвестный режим сопоставления точек: {job["join"]}')
+            print(f'{len(files)} файлов -> {output}: {seconds:.2f} с')
+            print(progress.summary())
+        case 'transient':
+            dynamic = get_dynamic(job, area_data)
+            coef_corr_puls = float(job.get('coef_corr', CONSTANTS.COEF_SPATIAL_CORR_PULS))
+            coef_corr_pik = float(job.get('coef_corr_pik', CONSTANTS.COEF_SPATIAL_CORR_PIK))
+            progress.connect()
+            outputs, seconds = timed_call(process_snapshots, files, height_building, width_building, index, dynamic, coef_corr_puls, coef_corr_pik, area_data, save_dir, job['backend'], job['workers'], job['name'], CONSTANTS.COORD_TOLERANCE, job['precision'], job['compress'], job['output_format'], int(job['epochs']), progress)
+            print(f'{len(files)} снимков -> {", ".join(outputs)}: {seconds:.2f} с')
+            print(progress.summary())
+        case _:
+            raise JobError(f'Неизвестный расчёт: {job.get("calculation")}')
+
+
+def load_jobs(file) -> list:
+    with open(file, 'r', encoding='utf-8') as f:
+        batch = json.load(f)
+    common = {key: value for key, value in batch.items() if key != 'jobs'}
+    return [{**common, **job} for job in batch.get('jobs', [])]
+
+
+def parse_args(argv) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='mm-technologies-tools', description='Расчёт пульсационных и пиковых нагрузок без графического интерфейса')
+    subparsers = parser.add_subparsers(dest='calculation', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('files', nargs='+')
+    common.add_argument('--height', type=float, required=True, help='высота здания, м')
+    common.add_argument('--width', type=float, required=True, help='ширина здания, м')
+    common.add_argument('--area-type', dest='area_type', choices=CONSTANTS.AREA_TYPES.keys(), default=DEFAULTS['area_type'])
+    common.add_argument('--coef-corr', dest='coef_corr', type=float, help='коэфф. пространственной корреляции')
+    common.add_argument('--backend', choices=CONSTANTS.BACKENDS.values(), default=DEFAULTS['backend'])
+    common.add_argument('--workers', type=int, default=DEFAULTS['workers'])
+    common.add_argument('--save-dir', dest='save_dir', default=DEFAULTS['save_dir'])
+    common.add_argument('--precision', type=int, default=DEFAULTS['precision'], help='знаков после запятой в выходных файлах')
+    common.add_argument('--compress', choices=CONSTANTS.COMPRESSION_LEVEL.keys(), default=DEFAULTS['compress'], help='сжимать выходные файлы (.gz, .zst)')
+    common.add_argument('--format', dest='output_format', choices=CONSTANTS.OUTPUT_FORMATS.keys(), default=DEFAULTS['output_format'], help='формат выходных файлов: csv для STAR-CCM+ или сжатые таблицы npz, parquet, arrow')
+
+    puls = subparsers.add_parser('puls', parents=[common], help='пульсационные нагрузки (файлы mean)')
+    puls.add_argument('--wind-area', dest='wind_area', choices=CONSTANTS.WIND_AREA.keys(), default=DEFAULTS['wind_area'])
+    puls.add_argument('--wind-pressure', dest='wind_pressure', type=float, help='давление ветра, Па (вместо ветрового района)')
+    puls.add_argument('--frequency', type=float, help='1-я собственная частота здания')
+    puls.add_argument('--decrement', choices=CONSTANTS.DECREMENT, default=DEFAULTS['decrement'])
+
+    sweep = subparsers.add_parser('sweep', parents=[common], help='пульсационные нагрузки для сетки вариантов за одно чтение файлов')
+    sweep.add_argument('--area-types', dest='area_types', nargs='+', choices=CONSTANTS.AREA_TYPES.keys(), default=DEFAULTS['area_types'])
+    sweep.add_argument('--wind-areas', dest='wind_areas', nargs='+', help='ветровые районы или давления, Па')
+    sweep.add_argument('--frequency', type=float, help='1-я собственная частота здания')
+    sweep.add_argument('--decrements', nargs='+', choices=CONSTANTS.DECREMENT, default=DEFAULTS['decrements'])
+
+    pik = subparsers.add_parser('pik', parents=[common], help='пиковые нагрузки (файлы max/min)')
+    pik.add_argument('--join', choices=CONSTANTS.JOIN_MODES.values(), default=DEFAULTS['join'])
+
+    transient = subparsers.add_parser('transient', parents=[common], help='mean, max, min, std по снимкам давления на каждом шаге по времени, затем пульсационные и пиковые нагрузки')
+    transient.add_argument('--name', default=DEFAULTS['name'], help='начало имён файлов статистики и пульсаций')
+    transient.add_argument('--coef-corr-pik', dest='coef_corr_pik', type=float, help='коэфф. пространственной корреляции для пиковых нагрузок (--coef-corr для пульсационных)')
+    transient.add_argument('--epochs', type=int, default=DEFAULTS['epochs'], help=f'оценивать пики по Гумбелю (Кук–Мейн) по N равным интервалам записи, например {CONSTANTS.PEAK_EPOCHS}; 0 — наибольшие значения')
+    transient.add_argument('--wind-area', dest='wind_area', choices=CONSTANTS.WIND_AREA.keys(), default=DEFAULTS['wind_area'])
+    transient.add_argument('--wind-pressure', dest='wind_pressure', type=float, help='давление ветра, Па (вместо ветрового района)')
+    transient.add_argument('--frequency', type=float, help='1-я собственная частота здания')
+    transient.add_argument('--decrement', choices=CONSTANTS.DECREMENT, default=DEFAULTS['decrement'])
+
+    batch = subparsers.add_parser('batch', help='пакет расчётов из JSON-файла')
+    batch.add_argument('job_file')
+
+    for subparser in (puls, sweep, pik, transient, batch):
+        subparser.add_argument('--profile', metavar='DIR', help='каталог для отчётов о производительности (JSON)')
+        subparser.add_argument('--cprofile', action='store_true', help='также сохранять профили cProfile (.prof)')
+        subparser.add_argument('--memory-budget', dest='memory_budget', type=float, help='память для одновременно выполняемых задач, ГБ (по умолчанию 80%% свободной)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    # passed through the environment so that worker processes are instrumented too
+    if args.profile:
+        os.environ['MMTT_PROFILE'] = args.profile
+    if args.cprofile:
+        os.environ['MMTT_CPROFILE'] = '1'
+    if args.memory_budget:
+        os.environ['MMTT_MEMORY_BUDGET'] = str(int(args.memory_budget * 1024 ** 3))
+    try:
+        if args.calculation == 'batch':
+            jobs = load_jobs(args.job_file)
+        else:
+            jobs = [{key: value for key, value in vars(args).items() if value is not None and key not in ('profile', 'cprofile', 'memory_budget')}]
+        for job in jobs:
+            run_job(job)
+    except (JobError, OSError, ValueError) as e:
+        print(f'Ошибка: {e}', file=sys.stderr)
+        return 1
+    except (Cancelled, KeyboardInterrupt):
+        print('Отменено', file=sys.stderr)
+        return 130
+    return 0
+
+
+if __name__ == '__main__':
+    freeze_support()
+    sys.exit(main())
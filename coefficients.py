@@ -0,0 +1,51 @@
+# scalar formulas used while the user fills in the form, kept free of numpy so that the window opens quickly
+from typing import List, Tuple
+
+from constants import CONSTANTS
+
+
+def building_index(height_building: float, width_building: float) -> int:
+    if height_building <= width_building:
+        return 1
+    elif height_building > (2 * width_building):
+        return 3
+    else:
+        return 2
+
+
+def calculate_zet(height_building: float, alfa: float, k_10: float) -> float:
+    return round(k_10 * pow((height_building * 0.8 / 10), (2 * alfa)), 3)
+
+
+def calculate_e1(pressure: float, zet: float, frequency: float) -> float:
+    return round(pow((pressure * zet * 1.4), 0.5) / 940 / frequency, 3)
+
+
+def calculate_dynamic(e1: float, decrement: str) -> float:
+    match decrement:
+        case '0.3':
+            result = -1917.9 * pow(e1, 4) + 971.95 * pow(e1, 3) - 187.65 * pow(e1, 2) + 19.745 * e1 + 1
+        case '0.15':
+            result = -3333.3 * pow(e1, 4) + 1666.7 * pow(e1, 3) - 311.67 * pow(e1, 2) + 31.833 * e1 + 1
+        case _:
+            raise ValueError(f'Unknown decrement: {decrement}')
+    return round(result, 3)
+
+
+def sweep_scenarios(height_building, area_types, wind_areas, decrements, frequency) -> List[Tuple[str, list, float]]:
+    # (name, area_data, dynamic) for every combination; wind areas are CONSTANTS.WIND_AREA keys or pressures in Pa,
+    # without the building frequency the dynamic coefficient is 1 and only the area type matters
+    scenarios = {}
+    for area_type in area_types:
+        area_data = CONSTANTS.AREA_TYPES[area_type]
+        if not frequency:
+            scenarios[area_type] = (area_data, 1)
+            continue
+        zet = calculate_zet(height_building, area_data[0], area_data[1])
+        for wind_area in wind_areas:
+            pressure = CONSTANTS.WIND_AREA.get(wind_area) or wind_area
+            label = wind_area.split()[0] if wind_area in CONSTANTS.WIND_AREA else f'{wind_area}Pa'
+            e1 = calculate_e1(float(pressure), zet, frequency)
+            for decrement in decrements:
+                scenarios[f'{area_type}_{label}_{decrement}'] = (area_data, calculate_dynamic(e1, decrement))
+    return [(name, area_data, dynamic) for name, (area_data, dynamic) in scenarios.items()]
@@ -0,0 +1,182 @@
+import os
+import zipfile
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from constants import CONSTANTS
+
+
+def table_format(file) -> Optional[str]:
+    # 'npz', 'parquet' or 'arrow' by the extension, None for text
+    name = file.lower()
+    return next((output_format for output_format, extension in CONSTANTS.OUTPUT_FORMATS.items() if output_format != 'csv' and name.endswith(extension)), None)
+
+
+def _pyarrow():
+    # optional, only needed for .parquet and .arrow files
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError('The pyarrow package is needed for .parquet and .arrow files: pip install pyarrow') from None
+    return pyarrow
+
+
+class TableOutput:
+    # written chunk by chunk with write(columns); an output left by an error is not completed
+    text = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.close(complete=exc_type is None)
+
+    def close(self, complete=True) -> None:
+        pass
+
+
+class RawTable(TableOutput):
+    # float64 rows without a header, the parts of a split file before they are joined
+    def __init__(self, file_name):
+        self.f = open(file_name, 'wb', buffering=CONSTANTS.WRITE_BUFFER)
+
+    def write(self, columns) -> None:
+        np.column_stack(columns).astype(np.float64, copy=False).tofile(self.f)
+
+    def close(self, complete=True) -> None:
+        self.f.close()
+
+
+class NpzTable(TableOutput):
+    # every column is spilled as raw float64 next to the output and stored as a deflated .npy member on close,
+    # so only a chunk is held in memory as for the text outputs
+    def __init__(self, file_name, header):
+        self.file_name = file_name
+        self.header = header
+        self.spills = [f'{file_name}.{os.getpid()}.{i}.f8' for i in range(len(header))]
+        self.files = []
+        try:
+            for spill in self.spills:
+                self.files.append(open(spill, 'wb', buffering=CONSTANTS.WRITE_BUFFER))
+        except BaseException:
+            self.close(complete=False)
+            raise
+
+    def write(self, columns) -> None:
+        for f, column in zip(self.files, columns, strict=True):
+            np.asarray(column, dtype=np.float64).tofile(f)
+
+    def close(self, complete=True) -> None:
+        try:
+            for f in self.files:
+                f.close()
+            if complete:
+                # higher deflate levels are much slower and gain little on float64 data
+                with zipfile.ZipFile(self.file_name, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as z:
+                    for name, spill in zip(self.header, self.spills):
+                        column = np.memmap(spill, dtype=np.float64, mode='r') if os.path.getsize(spill) else np.empty(0)
+                        with z.open(f'{name}.npy', 'w', force_zip64=True) as member:
+                            np.lib.format.write_array(member, column, allow_pickle=False)
+                        del column
+        finally:
+            for spill in self.spills:
+                try:
+                    os.remove(spill)
+                except OSError:
+                    pass
+
+
+class ArrowTable(TableOutput):
+    # a row group (.parquet) or a record batch (.arrow) per chunk, zstd compressed
+    def __init__(self, file_name, header, output_format):
+        pa = self.pa = _pyarrow()
+        self.schema = pa.schema([(name, pa.float64()) for name in header])
+        level = CONSTANTS.COMPRESSION_LEVEL['zst']
+        match output_format:
+            case 'parquet':
+                self.writer = pa.parquet.ParquetWriter(file_name, self.schema, compression='zstd', compression_level=level)
+            case 'arrow':
+                self.writer = pa.ipc.new_file(file_name, self.schema, options=pa.ipc.IpcWriteOptions(compression=pa.Codec('zstd', level)))
+
+    def write(self, columns) -> None:
+        self.writer.write_batch(self.pa.record_batch([np.asarray(column, dtype=np.float64) for column in columns], schema=self.schema))
+
+    def close(self, complete=True) -> None:
+        self.writer.close()
+
+
+def _npy_header(member) -> Tuple[tuple, np.dtype]:
+    version = np.lib.format.read_magic(member)
+    shape, _, dtype = np.lib.format.read_array_header_1_0(member) if version == (1, 0) else np.lib.format.read_array_header_2_0(member)
+    return shape, dtype
+
+
+def _batch_array(batch) -> np.ndarray:
+    return np.column_stack([column.to_numpy(zero_copy_only=False) for column in batch.columns]).astype(np.float64, copy=False)
+
+
+def iter_columnar(file, chunk_rows=CONSTANTS.CHUNK_ROWS) -> Iterator[np.ndarray]:
+    # (rows, columns) float64 chunks of a .npz, .parquet or .arrow table, the columns in the order of the file
+    match table_format(file):
+        case 'npz':
+            # the members are read side by side, a chunk of every column at a time
+            with zipfile.ZipFile(file) as z:
+                members = [z.open(name) for name in z.namelist()]
+                try:
+                    headers = [_npy_header(member) for member in members]
+                    if len({shape for shape, _ in headers}) > 1 or any(len(shape) != 1 for shape, _ in headers):
+                        raise ValueError(f'Expected one-dimensional columns of the same length in {file}')
+                    rows = headers[0][0][0] if headers else 0
+                    for start in range(0, rows, chunk_rows):
+                        count = min(chunk_rows, rows - start)
+                        yield np.column_stack([np.frombuffer(member.read(count * dtype.itemsize), dtype=dtype) for member, (_, dtype) in zip(members, headers)]).astype(np.float64, copy=False)
+                finally:
+                    for member in members:
+                        member.close()
+        case 'parquet':
+            for batch in _pyarrow().parquet.ParquetFile(file).iter_batches(batch_size=chunk_rows):
+                yield _batch_array(batch)
+        case 'arrow':
+            pa = _pyarrow()
+            with pa.memory_map(file) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    yield _batch_array(reader.get_batch(i))
+        case _:
+            raise ValueError(f'Not a columnar table: {file}')
+
+
+def table_columns(file) -> List[str]:
+    match table_format(file):
+        case 'npz':
+            with zipfile.ZipFile(file) as z:
+                return [name.removesuffix('.npy') for name in z.namelist()]
+        case 'parquet':
+            return _pyarrow().parquet.read_schema(file).names
+        case 'arrow':
+            pa = _pyarrow()
+            with pa.memory_map(file) as source:
+                return pa.ipc.open_file(source).schema.names
+    raise ValueError(f'Not a columnar table: {file}')
+
+
+def table_rows(file) -> int:
+    # from the .npy headers or the table metadata
+    match table_format(file):
+        case 'npz':
+            with zipfile.ZipFile(file) as z:
+                names = z.namelist()
+                if not names:
+                    return 0
+                with z.open(names[0]) as member:
+                    return _npy_header(member)[0][0]
+        case 'parquet':
+            return _pyarrow().parquet.ParquetFile(file).metadata.num_rows
+        case 'arrow':
+            pa = _pyarrow()
+            with pa.memory_map(file) as source:
+                return pa.ipc.open_file(source).count_rows()
+    raise ValueError(f'Not a columnar table: {file}')
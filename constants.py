@@ -1,5 +1,6 @@
 class CONSTANTS:
     APP_TITLE = 'MM-Technologies Tools-1'
+    VERSION = '0.0.1'
     TAB1_TITLE = "Пульсационные"
     TAB2_TITLE = "Пиковые"
     TAB3_TITLE = "Минимальные"
@@ -27,3 +28,41 @@ class CONSTANTS:
         'Да': 1,
     }
     DECREMENT = ['0.3', '0.15']
+    BACKENDS = {
+        'Процессы': 'processes',  # default
+        'Потоки': 'threads',
+    }
+    CHUNK_ROWS = 500000  # rows held in memory per processing step
+    JOIN_MODES = {
+        'По координатам': 'keyed',  # default
+        'Сортировка': 'sorted',
+    }
+    INPUT_KINDS = {
+        'Осреднённые (mean, max, min)': 'reduced',  # default, reductions exported by STAR-CCM+
+        'Снимки по шагам времени': 'snapshots',
+    }
+    PEAK_EPOCHS = 10  # equal parts of a transient record for the extreme value fit of the peaks
+    PEAK_FRACTILE = 0.78  # probability of the peak not being exceeded in an epoch, Cook-Mayne
+    PEAK_ESTIMATES = {
+        'Наибольшие значения': 0,  # default, max and min over all snapshots
+        'Гумбель (Кук–Мейн)': PEAK_EPOCHS,
+    }
+    COORD_TOLERANCE = 1e-6  # m, points this close in every coordinate are treated as the same mesh point
+    MESH_CACHE_DIR = '.mesh'  # created next to the input files
+    MESH_CACHE_SIZE = 1024 ** 3  # bytes of meshes kept in each .mesh directory, least recently used are removed
+    MESH_MEMORY = 2  # meshes kept in memory between runs of the GUI
+    DATA_CACHE_SIZE = 4 * 1024 ** 3  # bytes of parsed inputs and their coordinate text kept on disk, MMTT_CACHE_SIZE=0 turns it off
+    MEMORY_CACHE_SIZE = 1024 ** 3  # bytes of parsed inputs kept in memory between runs while the disk cache is off
+    CSV_PRECISION = None  # digits after the point in output files (e.g. 6 -> 1.234567e+02), None keeps full precision
+    WRITE_BLOCK_ROWS = 100000  # rows formatted per write call
+    WRITE_BUFFER = 16 * 1024 ** 2  # bytes
+    READ_BLOCK = 32 * 1024 ** 2  # bytes read at once from a byte range of a file
+    SPLIT_SIZE = 256 * 1024 ** 2  # files larger than this are split into parts processed in parallel
+    PROGRESS_INTERVAL = 0.5  # seconds between progress updates from the workers
+    SORT_MEMORY = 1024 ** 3  # bytes one sort task may use, larger files are sorted in runs spilled to disk
+    MEMORY_SHARE = 0.8  # part of the available memory the running tasks may take, see MMTT_MEMORY_BUDGET
+    COMPRESSION_LEVEL = {'gz': 6, 'zst': 3}  # .csv.gz / .csv.zst inputs are decompressed on the fly
+    OUTPUT_COMPRESSION = None  # 'gz' or 'zst' to write compressed output files
+    READ_AHEAD = 4  # blocks decompressed or waiting for compression in the background per file
+    OUTPUT_FORMATS = {'csv': '.csv', 'npz': '.npz', 'parquet': '.parquet', 'arrow': '.arrow'}  # the columnar ones are compressed and keep full precision, parquet and arrow need pyarrow
+    OUTPUT_FORMAT = 'csv'  # STAR-CCM+ imports only CSV
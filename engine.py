@@ -0,0 +1,130 @@
+import math
+from typing import Tuple
+
+import numpy as np
+
+
+def profile_pow(values: np.ndarray, alfa: float) -> np.ndarray:
+    # np.power may use SIMD kernels that differ from libm pow in the last bit,
+    # so the per-height power is evaluated with math.pow on unique heights only
+    unique, inverse = np.unique(values, return_inverse=True)
+    powers = np.fromiter((math.pow(z / 10, -alfa) for z in unique.tolist()), dtype=np.float64, count=unique.size)
+    return powers[inverse.reshape(values.shape)]
+
+
+def height_factor(Z: np.ndarray, index: int, height_building: float, width_building: float, alfa: float, dzeta10: float) -> np.ndarray:
+    dimension = height_building - width_building
+    factor = np.empty(Z.shape, dtype=np.float64)
+    match index:
+        case 1:
+            factor.fill(dzeta10 * pow(height_building / 10, -alfa))
+        case 2:
+            upper = Z >= dimension
+            factor[upper] = dzeta10 * pow(height_building / 10, -alfa)
+            factor[~upper] = dzeta10 * pow(width_building / 10, -alfa)
+        case 3:
+            upper = Z >= dimension
+            lower = ~upper & (Z <= width_building)
+            middle = ~upper & ~lower
+            factor[upper] = dzeta10 * pow(height_building / 10, -alfa)
+            factor[lower] = dzeta10 * pow(width_building / 10, -alfa)
+            factor[middle] = dzeta10 * profile_pow(Z[middle], alfa)
+        case _:
+            raise ValueError(f'Unknown index: {index}')
+    return factor
+
+
+def apply_puls(pressure: np.ndarray, factor: np.ndarray, dynamic, coef_corr) -> np.ndarray:
+    # same operation order as process_row_puls to keep results bit-identical, done in place
+    result = np.multiply(pressure, factor)
+    result *= dynamic
+    result *= coef_corr
+    result += pressure
+    return result
+
+
+def apply_puls_scenarios(pressure: np.ndarray, factors: np.ndarray, areas, dynamics, coef_corr) -> np.ndarray:
+    # one row per scenario: factors has a row per area type, areas picks the row of each scenario;
+    # the operations are those of apply_puls, so every row equals a separate run
+    result = np.multiply(pressure, factors)[areas]
+    result *= np.asarray(dynamics, dtype=np.float64)[:, None]
+    result *= coef_corr
+    result += pressure
+    return result
+
+
+def calculate_puls(pressure: np.ndarray, Z: np.ndarray, index, height_building, width_building, dynamic, coef_corr, alfa, dzeta10) -> np.ndarray:
+    factor = height_factor(Z, index, height_building, width_building, alfa, dzeta10)
+    return apply_puls(pressure, factor, dynamic, coef_corr)
+
+
+def calculate_pik(pressure: np.ndarray, Z: np.ndarray, index, height_building, width_building, coef_corr, alfa, dzeta10) -> np.ndarray:
+    factor = height_factor(Z, index, height_building, width_building, alfa, dzeta10)
+    return pressure * (1 + factor) * coef_corr
+
+
+def gumbel_peak(maxima: np.ndarray, fractile: float) -> np.ndarray:
+    # Gumbel distribution fitted to the epoch maxima (rows) of every point (columns) by L-moments, which are
+    # unbiased for the few epochs of a record; returns the value not exceeded in an epoch with the given
+    # probability, 0.78 gives the Cook-Mayne design peak U + 1.4/a
+    n = maxima.shape[0]
+    ordered = np.sort(maxima, axis=0)
+    b0 = ordered.mean(axis=0)
+    b1 = (ordered * (np.arange(n) / (n - 1))[:, None]).mean(axis=0)
+    scale = (2 * b1 - b0) / math.log(2)
+    location = b0 - np.euler_gamma * scale
+    return location - scale * math.log(-math.log(fractile))
+
+
+class RunningStats:
+    # per-point mean, M2 (Welford), max and min of snapshots added one at a time, so the memory does not
+    # depend on the number of snapshots; the update goes in blocks of points to keep the temporaries small.
+    # With epochs the max and min of each of that many equal parts of the steps snapshots are kept for peaks()
+    def __init__(self, size: int, steps: int = 0, epochs: int = 0, block: int = 1 << 20):
+        if epochs and not 2 <= epochs <= steps:
+            raise ValueError(f'Cannot split {steps} snapshots into {epochs} epochs')
+        self.count = 0
+        self.steps = steps
+        self.epochs = epochs
+        self.block = block
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.max = np.full(size, -np.inf)
+        self.min = np.full(size, np.inf)
+        self.epoch_max = np.full((epochs, size), -np.inf)
+        self.epoch_min = np.full((epochs, size), np.inf)
+
+    def add(self, values: np.ndarray) -> None:
+        if values.shape != self.mean.shape:
+            raise ValueError(f'Expected {self.mean.size} points, got {values.size}')
+        if self.epochs and self.count == self.steps:
+            raise ValueError(f'Expected {self.steps} snapshots')
+        epoch = self.count * self.epochs // self.steps if self.epochs else None
+        self.count += 1
+        for start in range(0, values.size, self.block):
+            part = slice(start, start + self.block)
+            x = values[part]
+            mean = self.mean[part]
+            delta = x - mean
+            mean += delta / self.count
+            delta *= x - mean
+            self.m2[part] += delta
+            np.maximum(self.max[part], x, out=self.max[part])
+            np.minimum(self.min[part], x, out=self.min[part])
+            if epoch is not None:
+                np.maximum(self.epoch_max[epoch, part], x, out=self.epoch_max[epoch, part])
+                np.minimum(self.epoch_min[epoch, part], x, out=self.epoch_min[epoch, part])
+
+    def std(self) -> np.ndarray:
+        # over all snapshots (ddof=0, as np.std)
+        return np.sqrt(self.m2 / self.count)
+
+    def peaks(self, fractile: float) -> Tuple[np.ndarray, np.ndarray]:
+        # estimated max and min peaks, the min peak is the max peak of the negated record
+        peak_max = np.empty(self.mean.size)
+        peak_min = np.empty(self.mean.size)
+        for start in range(0, self.mean.size, self.block):
+            part = slice(start, start + self.block)
+            peak_max[part] = gumbel_peak(self.epoch_max[:, part], fractile)
+            peak_min[part] = -gumbel_peak(-self.epoch_min[:, part], fractile)
+        return peak_max, peak_min
@@ -0,0 +1,530 @@
+import io
+import os
+import gzip
+import mmap
+import queue
+import itertools
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from columnar import ArrowTable, NpzTable, RawTable, TableOutput, iter_columnar, table_columns, table_format, table_rows
+from constants import CONSTANTS
+
+
+def split_file(file, parts) -> List[Tuple[int, int]]:
+    # byte ranges of the data rows, each starting at a line start and ending after a newline
+    size = os.path.getsize(file)
+    with open(file, 'rb') as f:
+        f.readline()
+        bounds = [f.tell()]
+        for i in range(1, parts):
+            f.seek(max(bounds[0] + (size - bounds[0]) * i // parts, bounds[-1]))
+            f.readline()
+            bounds.append(f.tell())
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def file_compression(file) -> Optional[str]:
+    # 'gz' or 'zst' by the extension, None for plain text
+    name = file.lower()
+    return next((compression for compression in CONSTANTS.COMPRESSION_LEVEL if name.endswith(f'.{compression}')), None)
+
+
+def output_name(file_name, compression=None, output_format=CONSTANTS.OUTPUT_FORMAT) -> str:
+    # columnar formats replace the .csv extension, they are compressed by themselves
+    if output_format != 'csv':
+        return os.path.splitext(file_name)[0] + CONSTANTS.OUTPUT_FORMATS[output_format]
+    return f'{file_name}.{compression}' if compression else file_name
+
+
+def _zstandard():
+    # optional, only needed for .zst files
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError('The zstandard package is needed for .zst files: pip install zstandard') from None
+    return zstandard
+
+
+def _decoder(raw, compression):
+    match compression:
+        case 'gz':
+            return gzip.GzipFile(fileobj=raw, mode='rb')
+        case 'zst':
+            return _zstandard().ZstdDecompressor().stream_reader(raw, read_size=1 << 16, read_across_frames=True, closefd=False)
+        case _:
+            raise ValueError(f'Unknown compression: {compression}')
+
+
+def _encoder(raw, compression):
+    level = CONSTANTS.COMPRESSION_LEVEL.get(compression)
+    match compression:
+        case 'gz':
+            return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=level)
+        case 'zst':
+            # zstd compresses in its own threads
+            return _zstandard().ZstdCompressor(level=level, threads=-1).stream_writer(raw, closefd=False)
+        case _:
+            raise ValueError(f'Unknown compression: {compression}')
+
+
+class ReadAhead(io.RawIOBase):
+    # decompresses in a background thread while the caller parses the previous blocks,
+    # zlib and zstd release the GIL so both run at the same time
+    def __init__(self, stream, *closing, block_size=CONSTANTS.READ_BLOCK, depth=CONSTANTS.READ_AHEAD):
+        super().__init__()
+        self.stream = stream
+        self.closing = closing
+        self.blocks = queue.Queue(depth)
+        self.buffer = memoryview(b'')
+        self.finished = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._fill, args=(block_size,), daemon=True)
+        self.thread.start()
+
+    def _fill(self, block_size) -> None:
+        try:
+            while not self.stopped.is_set():
+                data = self.stream.read(block_size)
+                self._put(data)
+                if not data:
+                    break
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.blocks.put(item, timeout=CONSTANTS.PROGRESS_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if not self.buffer:
+            if self.finished:
+                return 0
+            item = self.blocks.get()
+            if isinstance(item, Exception):
+                self.finished = True
+                raise item
+            if not item:
+                self.finished = True
+                return 0
+            self.buffer = memoryview(item)
+        count = min(len(b), len(self.buffer))
+        b[:count] = self.buffer[:count]
+        self.buffer = self.buffer[count:]
+        return count
+
+    def close(self) -> None:
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            for stream in (self.stream, *self.closing):
+                stream.close()
+        super().close()
+
+
+class WriteBehind(io.RawIOBase):
+    # compresses in a background thread while the caller formats the next rows
+    def __init__(self, stream, *closing, depth=CONSTANTS.READ_AHEAD):
+        super().__init__()
+        self.stream = stream
+        self.closing = closing
+        self.blocks = queue.Queue(depth)
+        self.error = None
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def _drain(self) -> None:
+        while (data := self.blocks.get()) is not None:
+            if self.error is None:
+                try:
+                    self.stream.write(data)
+                except Exception as e:
+                    self.error = e  # raised by the next write, the rest of the queue is dropped
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        if self.error is not None:
+            raise self.error
+        self.blocks.put(bytes(b))
+        return len(b)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.blocks.put(None)
+            self.thread.join()
+            try:
+                if self.error is None:
+                    self.stream.close()
+            finally:
+                for stream in self.closing:
+                    stream.close()
+            if self.error is not None:
+                raise self.error
+        super().close()
+
+
+def open_input(file, mode='r', newline=None):
+    # .gz and .zst files are decompressed on the fly, the caller sees plain text (or bytes with mode 'rb')
+    compression = file_compression(file)
+    if compression is None:
+        return open(file, mode, newline=None if 'b' in mode else newline)
+    raw = open(file, 'rb')
+    try:
+        stream = io.BufferedReader(ReadAhead(_decoder(raw, compression), raw), CONSTANTS.READ_BLOCK)
+    except BaseException:
+        raw.close()
+        raise
+    return stream if 'b' in mode else io.TextIOWrapper(stream, newline=newline)
+
+
+def _sample(file, sample) -> Tuple[bytes, int, bool]:
+    # the first bytes of the text, the estimated size of the whole text and whether the sample is all of it
+    size = os.path.getsize(file)
+    compression = file_compression(file)
+    with open(file, 'rb') as raw:
+        if compression is None:
+            data = raw.read(sample)
+            return data, size, len(data) >= size
+        with _decoder(raw, compression) as f:
+            data = f.read(max(sample, 1 << 20))
+            read = raw.tell()
+            complete = not f.read(1)
+    # compressed files are scaled by the compression ratio of the sample
+    return data, len(data) if complete else int(size * len(data) / max(read, 1)), complete
+
+
+def data_size(file) -> int:
+    # bytes of text, estimated for compressed files; the parsed size for columnar tables
+    if table_format(file) is not None:
+        return table_rows(file) * len(table_columns(file)) * 8
+    if file_compression(file) is None:
+        return os.path.getsize(file)
+    return _sample(file, 1 << 20)[1]
+
+
+def estimate_rows(file, sample=1 << 16) -> int:
+    # from the mean length of the first lines, exact for files shorter than the sample
+    if table_format(file) is not None:
+        return table_rows(file)
+    data, size, complete = _sample(file, sample)
+    start = data.find(b'\n') + 1
+    if not start:
+        return 0
+    data = data[start:]
+    lines = data.count(b'\n') + (bool(data) and not data.endswith(b'\n'))
+    if not lines or complete:
+        return lines
+    return int((size - start) * lines / len(data))
+
+
+def iter_blocks(file, start=0, end=None, block_size=CONSTANTS.READ_BLOCK) -> Iterator[bytes]:
+    # the data lines in blocks of whole lines; plain files are memory-mapped and can be limited to a byte range
+    # from split_file, compressed files are decompressed from the start
+    if file_compression(file) is not None:
+        with open_input(file, 'rb') as f:
+            f.readline()
+            while data := f.read(block_size):
+                if not data.endswith(b'\n'):
+                    data += f.readline()
+                yield data
+        return
+    with open(file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = max(start, data.find(b'\n') + 1 or size)
+            end = size if end is None else end
+            while position < end:
+                stop = min(position + block_size, end)
+                if stop < end:
+                    stop = min(data.find(b'\n', stop - 1) + 1 or end, end)
+                yield data[position:stop]
+                position = stop
+
+
+def _field_starts(lines: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # the printable bytes, the positions where fields start and the number of fields before the end of every line:
+    # a field starts at a printable character (all are above the space) after whitespace, and the starts
+    # before each line end are found by a binary search
+    text = lines > 32
+    starts = np.empty_like(text)
+    starts[0] = text[0]
+    np.greater(text[1:], text[:-1], out=starts[1:])
+    ends = np.flatnonzero(lines == 10)
+    if not ends.size or ends[-1] != lines.size - 1:
+        ends = np.append(ends, lines.size)
+    starts = np.flatnonzero(starts)
+    return text, starts, np.searchsorted(starts, ends)
+
+
+def count_fields(data: bytes) -> np.ndarray:
+    # the number of fields on every line
+    lines = np.frombuffer(data, dtype=np.uint8)
+    if not lines.size:
+        return np.empty(0, dtype=np.intp)
+    return np.diff(_field_starts(lines)[2], prepend=0)
+
+
+def _check_fields(fields: np.ndarray, line) -> Tuple[int, int]:
+    # the rows and columns of a block, every line that is not blank has as many fields as the first one
+    filled = fields[fields > 0]
+    if not filled.size:
+        return 0, 0
+    columns = int(filled[0])
+    wrong = np.flatnonzero((fields > 0) & (fields != columns))
+    if wrong.size:
+        raise ValueError(f'Line {line + int(wrong[0])}: expected {columns} numbers, found {fields[wrong[0]]}')
+    return filled.size, columns
+
+
+def parse_block(data: bytes, line=1) -> np.ndarray:
+    # tab or space separated numbers of whole lines into a (rows, columns) array, parsed in C
+    # without a Python object per row or field; the column count is that of the first line,
+    # line is the number of the first line of the block in the file for the error message
+    rows, columns = _check_fields(count_fields(data), line)
+    if not rows:
+        return np.empty((0, 0), dtype=np.float64)
+    values = np.fromstring(data, dtype=np.float64, sep=' ')
+    if values.size != rows * columns:
+        raise ValueError(f'Expected {rows} rows of {columns} numbers from line {line}, parsed {values.size} numbers')
+    return values.reshape(rows, columns)
+
+
+def split_first_column(data: bytes, line=1) -> Tuple[np.ndarray, np.ndarray]:
+    # the first column of a block parsed and the bytes of the other columns left unparsed: each line is cut
+    # where its second field starts and only the first parts are parsed
+    lines = np.frombuffer(data, dtype=np.uint8)
+    if not lines.size:
+        return np.empty(0, dtype=np.float64), lines
+    _, starts, before = _field_starts(lines)
+    fields = np.diff(before, prepend=0)
+    rows, columns = _check_fields(fields, line)
+    if not rows:
+        return np.empty(0, dtype=np.float64), lines
+    if columns < 2:
+        raise ValueError(f'Expected more than one column from line {line}')
+    first = (before - fields)[fields > 0]
+    bounds = np.empty(2 * rows + 2, dtype=np.intp)
+    bounds[0], bounds[-1] = 0, lines.size
+    bounds[1:-1:2] = starts[first]
+    bounds[2:-1:2] = starts[first + 1]
+    rest = np.zeros(bounds.size - 1, dtype=bool)
+    rest[::2] = True
+    rest = np.repeat(rest, np.diff(bounds))
+    values = np.fromstring(lines[~rest], dtype=np.float64, sep=' ')
+    if values.size != rows:
+        raise ValueError(f'Expected {rows} numbers in the first column from line {line}, parsed {values.size}')
+    return values, lines[rest]
+
+
+def text_rows(data: bytes, columns, skip=1) -> np.ndarray:
+    # the fields of every row after the first skip as b'x y z\n' lines, the input text joined by single spaces;
+    # built on the bytes, every field keeps the whitespace byte after it, which becomes a space or the line end
+    lines = np.frombuffer(data, dtype=np.uint8)
+    if data[-1:] > b' ':
+        lines = np.append(lines, np.uint8(10))
+    text = lines > 32
+    keep = text.copy()
+    keep[1:] |= text[:-1]
+    rows = lines[keep]
+    ends = np.flatnonzero(rows <= 32)
+    if ends.size % columns:
+        raise ValueError(f'Expected rows of {columns} fields, found {ends.size} fields')
+    rows[ends] = 32
+    rows[ends[columns - 1::columns]] = 10
+    if not skip or not ends.size:
+        return rows
+    # the skipped fields of a row run from its start to the end of field skip, the rest of the row is kept
+    bounds = np.empty(2 * (ends.size // columns) + 1, dtype=np.intp)
+    bounds[0] = 0
+    bounds[2:-1:2] = ends[columns - 1:-1:columns] + 1
+    bounds[1::2] = ends[skip - 1::columns] + 1
+    bounds[-1] = rows.size
+    kept = np.zeros(bounds.size - 1, dtype=bool)
+    kept[1::2] = True
+    return rows[np.repeat(kept, np.diff(bounds))]
+
+
+def text_lines(rows: np.ndarray) -> List[str]:
+    # the lines of text_rows as strings, ready to be written as one column
+    return rows.tobytes().decode().split('\n')[:-1]
+
+
+def iter_parsed(file, start=0, end=None, block_size=CONSTANTS.READ_BLOCK) -> Iterator[Tuple[np.ndarray, Optional[bytes], int]]:
+    # the parsed blocks of a file or of a byte range with their text and the number of bytes they came from;
+    # columnar tables are read in chunks without text
+    if table_format(file) is not None:
+        for table in iter_columnar(file):
+            yield table, None, table.nbytes
+        return
+    line = 2  # the header is line 1
+    for data in iter_blocks(file, start, end, block_size):
+        try:
+            table = parse_block(data, line)
+        except ValueError:
+            if not start:
+                raise
+            # the lines before a byte range are counted only for the message, parsing again raises with them
+            parse_block(data, line - 1 + _count_newlines(file, start))
+            raise
+        yield table, data, len(data)
+        line += data.count(b'\n')
+
+
+def iter_first_column(file, block_size=CONSTANTS.READ_BLOCK) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    # the first column of a text file parsed block by block with the text of the other columns
+    line = 2  # the header is line 1
+    for data in iter_blocks(file, block_size=block_size):
+        yield split_first_column(data, line)
+        line += data.count(b'\n')
+
+
+def iter_tables(file, start=0, end=None, block_size=CONSTANTS.READ_BLOCK) -> Iterator[Tuple[np.ndarray, int]]:
+    for table, _, nbytes in iter_parsed(file, start, end, block_size):
+        yield table, nbytes
+
+
+def iter_array_chunks(file, chunk_rows=CONSTANTS.CHUNK_ROWS) -> Iterator[Tuple[np.ndarray, int]]:
+    # chunks of exactly chunk_rows rows (the last one shorter), so the chunks of files with the same points line up
+    pending, rows, nbytes = [], 0, 0
+    for table, size in iter_tables(file, block_size=min(CONSTANTS.READ_BLOCK, chunk_rows * 64)):
+        if not len(table):
+            continue
+        pending.append(table)
+        rows += len(table)
+        nbytes += size
+        while rows >= chunk_rows:
+            table = np.concatenate(pending) if len(pending) > 1 else pending[0]
+            yield table[:chunk_rows], nbytes * chunk_rows // rows
+            pending, rows, nbytes = [table[chunk_rows:]], rows - chunk_rows, nbytes - nbytes * chunk_rows // rows
+    if rows:
+        yield np.concatenate(pending), nbytes
+
+
+def read_array(file, usecols=None) -> np.ndarray:
+    # the data rows of a plain file are counted first and parsed into one preallocated array
+    if file_compression(file) is not None or table_format(file) is not None:
+        tables = [table if usecols is None else table[:, usecols] for table, _ in iter_tables(file) if len(table)]
+        return np.concatenate(tables) if tables else np.empty((0, 0 if usecols is None else len(usecols)))
+    table = None
+    rows = 0
+    line = 2  # the header is line 1
+    for block in iter_blocks(file):
+        chunk = parse_block(block, line)
+        line += block.count(b'\n')
+        if not len(chunk):
+            continue
+        if usecols is not None:
+            chunk = chunk[:, usecols]
+        if table is None:
+            table = np.empty((_count_lines(file), chunk.shape[1]), dtype=np.float64)
+        table[rows:rows + len(chunk)] = chunk
+        rows += len(chunk)
+    if table is None:
+        return np.empty((0, 0 if usecols is None else len(usecols)))
+    return table[:rows]
+
+
+def _count_newlines(file, end) -> int:
+    with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return sum(data[i:min(i + CONSTANTS.READ_BLOCK, end)].count(b'\n') for i in range(0, end, CONSTANTS.READ_BLOCK))
+
+
+def _count_lines(file) -> int:
+    # an upper bound of the data rows, counted in the memory map without reading the file into Python
+    with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        view = np.frombuffer(data, dtype=np.uint8)
+        lines = sum(int(np.count_nonzero(view[i:i + CONSTANTS.READ_BLOCK] == 10)) for i in range(0, view.size, CONSTANTS.READ_BLOCK))
+        del view  # the map cannot be closed while an array uses it
+    return lines + 1
+
+
+def open_binary_output(file_name, compression=None):
+    # compression defaults to the one of the file name extension
+    compression = compression or file_compression(file_name)
+    if compression is None:
+        return open(file_name, 'wb', buffering=CONSTANTS.WRITE_BUFFER)
+    raw = open(file_name, 'wb')
+    try:
+        return io.BufferedWriter(WriteBehind(_encoder(raw, compression), raw), CONSTANTS.WRITE_BUFFER)
+    except BaseException:
+        raw.close()
+        raise
+
+
+def open_output(file_name, compression=None):
+    compression = compression or file_compression(file_name)
+    if compression is None:
+        return open(file_name, 'w', newline='', buffering=CONSTANTS.WRITE_BUFFER)
+    return io.TextIOWrapper(open_binary_output(file_name, compression), newline='')
+
+
+class TextTable(TableOutput):
+    # delimited text, the columns are arrays or already formatted text; parts of a split file have no header
+    text = True
+
+    def __init__(self, file_name, header, delimiter, precision=CONSTANTS.CSV_PRECISION, compression=CONSTANTS.OUTPUT_COMPRESSION):
+        self.f = open_output(file_name, compression)
+        self.delimiter = delimiter
+        self.precision = precision
+        if header:
+            write_header(self.f, header, delimiter)
+
+    def write(self, columns) -> None:
+        write_columns(self.f, columns, self.delimiter, self.precision)
+
+    def close(self, complete=True) -> None:
+        self.f.close()
+
+
+def open_table(file_name, header, delimiter, precision=CONSTANTS.CSV_PRECISION, compression=CONSTANTS.OUTPUT_COMPRESSION, output_format=CONSTANTS.OUTPUT_FORMAT) -> TableOutput:
+    match output_format:
+        case 'csv':
+            return TextTable(file_name, header, delimiter, precision, compression)
+        case 'npz':
+            return NpzTable(file_name, header)
+        case 'parquet' | 'arrow':
+            return ArrowTable(file_name, header, output_format)
+        case 'raw':
+            return RawTable(file_name)
+    raise ValueError(f'Unknown output format: {output_format}')
+
+
+def write_header(f, header, delimiter) -> None:
+    f.write(delimiter.join(header) + '\r\n')
+
+
+def write_columns(f, columns, delimiter, precision=CONSTANTS.CSV_PRECISION, block_rows=CONSTANTS.WRITE_BLOCK_ROWS) -> None:
+    # rows are formatted with one %-operation per block instead of one csv.writer call per row;
+    # line endings match csv.writer, arrays are written as repr() unless a fixed precision is given
+    float_format = '%s' if precision is None else f'%.{precision}e'
+    row_format = delimiter.join(float_format if isinstance(column, np.ndarray) else '%s' for column in columns) + '\r\n'
+    for start in range(0, len(columns[0]), block_rows):
+        block = [column[start:start + block_rows] for column in columns]
+        block = [column.tolist() if isinstance(column, np.ndarray) else column for column in block]
+        f.write((row_format * len(block[0])) % tuple(itertools.chain.from_iterable(zip(*block))))
+
+
+def format_rows(columns, delimiter, precision=CONSTANTS.CSV_PRECISION) -> List[str]:
+    # rows formatted like write_columns but without line endings, for text reused in several outputs
+    float_format = '%s' if precision is None else f'%.{precision}e'
+    row_format = delimiter.join(float_format if isinstance(column, np.ndarray) else '%s' for column in columns) + '\n'
+    columns = [column.tolist() if isinstance(column, np.ndarray) else column for column in columns]
+    return ((row_format * len(columns[0])) % tuple(itertools.chain.from_iterable(zip(*columns)))).split('\n')[:-1]
+
+
+def write_table(f, table: np.ndarray, delimiter, precision=CONSTANTS.CSV_PRECISION) -> None:
+    write_columns(f, list(table.T), delimiter, precision)
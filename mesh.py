@@ -0,0 +1,178 @@
+import os
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+from constants import CONSTANTS
+from cache import evict
+from columnar import table_format
+from fileio import iter_first_column, iter_tables, read_array
+
+
+def quantize(xyz: np.ndarray, tolerance: float) -> np.ndarray:
+    return np.rint(xyz / tolerance).astype(np.int64)
+
+
+def coordinate_keys(quantized: np.ndarray) -> np.ndarray:
+    # 64-bit mix of the quantized coordinates; collisions are ruled out in PointIndex.lookup
+    q = quantized.astype(np.uint64)
+    keys = q[:, 0] * np.uint64(0x9E3779B97F4A7C15)
+    keys ^= q[:, 1] * np.uint64(0xC2B2AE3D27D4EB4F) + (keys << np.uint64(6)) + (keys >> np.uint64(2))
+    keys ^= q[:, 2] * np.uint64(0x165667B19E3779F9) + (keys << np.uint64(6)) + (keys >> np.uint64(2))
+    return keys
+
+
+class PointIndex:
+    # points match when they are within the tolerance in every coordinate: such points lie in the same
+    # grid cell of that size or in one of the 26 around it
+    NEIGHBOURS = np.array([offset for offset in itertools.product((-1, 0, 1), repeat=3) if any(offset)], dtype=np.int64)
+
+    def __init__(self, xyz: np.ndarray, tolerance: float):
+        self.tolerance = tolerance
+        self.xyz = xyz
+        self.quantized = quantize(xyz, tolerance)
+        keys = coordinate_keys(self.quantized)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def __len__(self) -> int:
+        return self.keys.size
+
+    def _cell(self, quantized: np.ndarray) -> np.ndarray:
+        # a point of the index in each cell, -1 for empty cells
+        keys = coordinate_keys(quantized)
+        pos = np.searchsorted(self.keys, keys)
+        pos[pos == self.keys.size] = 0
+        found = self.order[pos]
+        match = (self.keys[pos] == keys) & np.all(self.quantized[found] == quantized, axis=1)
+        return np.where(match, found, -1)
+
+    def lookup(self, xyz: np.ndarray) -> np.ndarray:
+        quantized = quantize(xyz, self.tolerance)
+        found = self._cell(quantized)
+        # points near a cell boundary are looked up in the cells around theirs, only those left unmatched
+        missing = np.flatnonzero(found < 0)
+        for offset in self.NEIGHBOURS:
+            if not missing.size:
+                break
+            candidates = self._cell(quantized[missing] + offset)
+            close = candidates >= 0
+            close[close] = np.all(np.abs(self.xyz[candidates[close]] - xyz[missing[close]]) <= self.tolerance, axis=1)
+            found[missing[close]] = candidates[close]
+            missing = missing[~close]
+        return found
+
+
+class Mesh:
+    def __init__(self, fingerprint: str, xyz: np.ndarray, order: np.ndarray):
+        self.fingerprint = fingerprint
+        self.xyz = xyz
+        self.order = order  # permutation sorting the points by X, Y, Z
+        self._points = None
+
+    def __len__(self) -> int:
+        return len(self.xyz)
+
+    def points(self, tolerance=CONSTANTS.COORD_TOLERANCE) -> PointIndex:
+        if self._points is None or self._points.tolerance != tolerance:
+            self._points = PointIndex(self.xyz, tolerance)
+        return self._points
+
+
+_meshes = OrderedDict()  # the most recently used meshes by fingerprint, at most MESH_MEMORY
+_meshes_lock = threading.Lock()
+
+
+def _mesh_dir(file) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(file)), CONSTANTS.MESH_CACHE_DIR)
+
+
+def _known_head(file, head) -> bool:
+    # a mesh that starts with the same points is in memory or on disk, the file is most likely on it
+    prefix = f'{head}-'
+    with _meshes_lock:
+        fingerprints = list(_meshes)
+    if any(fingerprint.startswith(prefix) for fingerprint in fingerprints):
+        return True
+    try:
+        return any(name.startswith(prefix) for name in os.listdir(_mesh_dir(file)))
+    except OSError:
+        return False
+
+
+def _scan(file, coordinates) -> Tuple[np.ndarray, str, Optional[np.ndarray]]:
+    # parses only the pressure column of text files, the coordinate text is hashed into the mesh fingerprint:
+    # the hash of the first block (the head) and that of all blocks. With coordinates they are parsed as well
+    # for a new mesh, unless a cached mesh has the same head
+    columnar = table_format(file) is not None
+    if columnar:
+        blocks = ((np.array(table[:, 0]), np.ascontiguousarray(table[:, 1:])) for table, _ in iter_tables(file) if len(table))
+    else:
+        blocks = iter_first_column(file)
+    digest = hashlib.blake2b(digest_size=16)
+    head = None
+    pressures, points = [], []
+    for pressure, rest in blocks:
+        if head is None:
+            head = hashlib.blake2b(rest, digest_size=4).hexdigest()
+            coordinates = coordinates and not _known_head(file, head)
+        digest.update(rest)
+        pressures.append(pressure)
+        if coordinates:
+            points.append(rest if columnar else np.fromstring(rest, dtype=np.float64, sep=' ').reshape(len(pressure), 3))
+    pressure = np.concatenate(pressures) if pressures else np.empty(0, dtype=np.float64)
+    digest.update(str(pressure.size).encode())
+    if head is None:
+        head = hashlib.blake2b(b'', digest_size=4).hexdigest()
+    xyz = (np.concatenate(points) if points else np.empty((0, 3))) if coordinates else None
+    return pressure, f'{head}-{digest.hexdigest()}', xyz
+
+
+def scan_file(file) -> Tuple[np.ndarray, str]:
+    pressure, fingerprint, _ = _scan(file, False)
+    return pressure, fingerprint
+
+
+def load_mesh(file, fingerprint, xyz=None) -> Mesh:
+    # xyz are the coordinates of the file if they were parsed already, otherwise they are read on a miss
+    with _meshes_lock:
+        if fingerprint in _meshes:
+            _meshes.move_to_end(fingerprint)
+            return _meshes[fingerprint]
+
+    cache_dir = _mesh_dir(file)
+    cache_file = os.path.join(cache_dir, f'{fingerprint}.npz')
+    try:
+        with np.load(cache_file) as data:
+            mesh = Mesh(fingerprint, data['xyz'], data['order'])
+        os.utime(cache_file)  # least recently used meshes are evicted first
+    except (OSError, KeyError, ValueError):
+        if xyz is None:
+            xyz = read_array(file, usecols=(1, 2, 3))
+        order = np.lexsort((xyz[:, 2], xyz[:, 1], xyz[:, 0]))
+        mesh = Mesh(fingerprint, xyz, order)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'wb') as f:
+                np.savez(f, xyz=xyz, order=order)
+            os.replace(tmp_file, cache_file)
+            evict(cache_file, CONSTANTS.MESH_CACHE_SIZE, cache_dir, ('.npz',))
+        except OSError:
+            pass  # read-only data directory, the index is rebuilt next time
+
+    with _meshes_lock:
+        _meshes[fingerprint] = mesh
+        while len(_meshes) > CONSTANTS.MESH_MEMORY:
+            _meshes.popitem(last=False)
+    return mesh
+
+
+def read_with_mesh(file) -> Tuple[np.ndarray, Mesh]:
+    # the coordinates are parsed in the same pass when the mesh is new
+    pressure, fingerprint, xyz = _scan(file, True)
+    return pressure, load_mesh(file, fingerprint, xyz)
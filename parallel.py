@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+from multiprocessing import get_context
+
+from constants import CONSTANTS
+from profiling import profiled
+from progress import Cancelled, connect, finish_task
+
+
+def available_memory() -> int:
+    # physical memory that can be used without swapping, 0 when unknown
+    if sys.platform == 'win32':
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [
+                ('dwLength', ctypes.c_ulong),
+                ('dwMemoryLoad', ctypes.c_ulong),
+                ('ullTotalPhys', ctypes.c_ulonglong),
+                ('ullAvailPhys', ctypes.c_ulonglong),
+                ('ullTotalPageFile', ctypes.c_ulonglong),
+                ('ullAvailPageFile', ctypes.c_ulonglong),
+                ('ullTotalVirtual', ctypes.c_ulonglong),
+                ('ullAvailVirtual', ctypes.c_ulonglong),
+                ('ullAvailExtendedVirtual', ctypes.c_ulonglong),
+            ]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(status)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+        return 0
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def memory_budget() -> int:
+    # MMTT_MEMORY_BUDGET in bytes, otherwise a share of the memory available when the tasks start
+    budget = os.environ.get('MMTT_MEMORY_BUDGET')
+    if budget:
+        return int(float(budget))
+    return int(available_memory() * CONSTANTS.MEMORY_SHARE) or sys.maxsize
+
+
+def create_executor(backend, workers, initializer=None, initargs=()) -> Executor:
+    match backend:
+        case 'processes':
+            # spawn keeps child processes free of the GUI threads and works in the frozen build
+            return ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'), initializer=initializer, initargs=initargs)
+        case 'threads':
+            return ThreadPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+        case _:
+            raise ValueError(f'Unknown backend: {backend}')
+
+
+def run_tasks(func, tasks, backend, workers, job=None, costs=None, on_result=None) -> list:
+    # costs are the estimated (bytes of memory, rows) of every task: the longest tasks are started first
+    # while they fit into the memory budget, one task is always allowed to run even if it does not fit;
+    # on_result(i, result) is called in this thread as every task finishes, its result is then not kept
+    if not tasks:
+        return []
+    func = profiled(func)
+    costs = costs or [(0, 0)] * len(tasks)
+    memory = [cost[0] for cost in costs]
+    budget = memory_budget()
+    workers = min(workers, len(tasks))
+    queue = sorted(range(len(tasks)), key=lambda i: costs[i][::-1], reverse=True)
+    results = [None] * len(tasks)
+    errors = {}
+    running = {}
+    started = 0
+    used = 0
+    if job is None:
+        executor = create_executor(backend, workers)
+    else:
+        executor = create_executor(backend, workers, connect, (job.messages, job.cancel_event))
+        finished = job.finished_tasks
+        func = partial(reported_call, func)
+    with executor:
+        while queue or running:
+            while queue and len(running) < workers:
+                fits = [i for i in queue if used + memory[i] <= budget]
+                if not fits and running:
+                    break
+                i = fits[0] if fits else queue[0]
+                queue.remove(i)
+                running[executor.submit(func, *tasks[i])] = i
+                started += 1
+                used += memory[i]
+            if job is not None:
+                job.schedule(len(queue), len(running), workers, used, budget)
+            try:
+                done, _ = wait(running, timeout=CONSTANTS.PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                if job is None:
+                    raise
+                job.cancel()
+                done = set()
+            for future in done:
+                i = running.pop(future)
+                used -= memory[i]
+                try:
+                    if on_result is None:
+                        results[i] = future.result()
+                    elif not errors and not (job is not None and job.cancelled):
+                        on_result(i, future.result())
+                except Exception as e:
+                    errors[i] = e
+            if job is not None:
+                job.poll()
+            if (job is not None and job.cancelled) or errors:
+                # running tasks stop at their next chunk, queued ones are not started
+                if job is not None:
+                    job.cancel()
+                queue.clear()
+    if job is not None:
+        job.schedule(0, 0, workers, 0, budget)
+        job.drain(finished + started)
+    for i in sorted(errors):
+        if not isinstance(errors[i], Cancelled):
+            raise errors[i]
+    if errors or (job is not None and job.cancelled):
+        raise Cancelled()
+    return results
+
+
+def reported_call(func, *args):
+    try:
+        return func(*args)
+    finally:
+        finish_task()
+
+
+def timed_call(func, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
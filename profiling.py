@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import platform
+import threading
+import itertools
+from functools import partial
+
+from constants import CONSTANTS
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# MMTT_PROFILE=<directory> turns instrumentation on, a JSON report per run is written there;
+# MMTT_CPROFILE=1 additionally dumps a cProfile .prof file per task into the same directory.
+# Both are environment variables so that spawned worker processes see them too.
+
+_counter = itertools.count()
+
+
+def profile_dir():
+    return os.environ.get('MMTT_PROFILE') or None
+
+
+def enabled() -> bool:
+    return profile_dir() is not None
+
+
+def cprofile_enabled() -> bool:
+    return enabled() and os.environ.get('MMTT_CPROFILE', '0') not in ('', '0')
+
+
+def peak_rss() -> int:
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ('cb', wintypes.DWORD),
+                ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        if kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except (ImportError, AttributeError, OSError):
+        pass
+    return 0
+
+
+def task_name(func) -> str:
+    # timed_call(process_file_puls, ...) is reported as process_file_puls
+    while isinstance(func, partial):
+        func = func.args[0] if func.args and callable(func.args[0]) else func.func
+    return getattr(func, '__name__', type(func).__name__)
+
+
+class Profiled:
+    # module level class so that wrapped tasks can still be sent to worker processes
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(self.func, *args)
+        finally:
+            name = f'{task_name(partial(self.func, *args))}-{os.getpid()}-{threading.get_ident()}-{next(_counter)}.prof'
+            profile.dump_stats(os.path.join(profile_dir(), name))
+
+
+def profiled(func):
+    if not cprofile_enabled():
+        return func
+    os.makedirs(profile_dir(), exist_ok=True)
+    return Profiled(func)
+
+
+def timings(stages, cpu) -> dict:
+    return {stage: {'wall': round(stages.get(stage, 0.0), 6), 'cpu': round(cpu.get(stage, 0.0), 6)} for stage in {**stages, **cpu} if stages.get(stage) or cpu.get(stage)}
+
+
+def write_report(job, name, parameters=None):
+    # returns the report path, or None when instrumentation is off
+    directory = profile_dir()
+    if directory is None:
+        return None
+    files = {
+        file: {
+            'rows': rows,
+            'bytes': nbytes,
+            'peak_rss': job.peak_rss.get(file, 0),
+            'stages': timings(*job.timings.get(file, ({}, {}))),
+        }
+        for file, (rows, nbytes) in job.files.items()
+    }
+    data = {
+        'name': name,
+        'version': CONSTANTS.VERSION,
+        'started': job.started.isoformat(timespec='seconds'),
+        'cancelled': job.cancelled,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'argv': sys.argv,
+        'parameters': parameters or {},
+        'wall': round(job.elapsed(), 6),
+        # cpu of the stages includes worker processes, process_cpu is this process only
+        'cpu': round(sum(job.cpu.values()), 6),
+        'process_cpu': round(time.process_time(), 6),
+        'peak_rss': max([peak_rss(), *job.peak_rss.values()]),
+        'rows': job.rows(),
+        'bytes': sum(nbytes for _, nbytes in job.files.values()),
+        'stages': timings(job.stages, job.cpu),
+        # largest number of tasks running at once and their estimated memory
+        'scheduling': job.peak_scheduling,
+        'files': files,
+    }
+    os.makedirs(directory, exist_ok=True)
+    file_name = os.path.join(directory, f'{job.started:%Y%m%d-%H%M%S}-{name}-{os.getpid()}.json')
+    with open(file_name, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+    return file_name
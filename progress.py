@@ -0,0 +1,192 @@
+import os
+import queue
+import datetime
+import threading
+import time
+from multiprocessing import get_context
+
+from profiling import enabled, peak_rss
+
+
+STAGES = {
+    'parse': 'чтение',
+    'compute': 'расчёт',
+    'sort': 'сортировка',
+    'write': 'запись',
+}
+
+
+class Cancelled(Exception):
+    pass
+
+
+_local = threading.local()
+
+
+def connect(messages, cancel_event) -> None:
+    # called in every worker thread or process; messages is anything with put()
+    _local.messages = messages
+    _local.cancel_event = cancel_event
+
+
+def check_cancelled() -> None:
+    cancel_event = getattr(_local, 'cancel_event', None)
+    if cancel_event is not None and cancel_event.is_set():
+        raise Cancelled()
+
+
+def finish_task() -> None:
+    # sent after the last report of a task, the queue keeps the order of one process's messages
+    messages = getattr(_local, 'messages', None)
+    if messages is not None:
+        messages.put(None)
+
+
+def report(file, rows=0, nbytes=0, stages=None, cpu=None) -> None:
+    messages = getattr(_local, 'messages', None)
+    if messages is not None:
+        messages.put((file, rows, nbytes, stages or {}, cpu or {}, peak_rss() if enabled() else 0))
+
+
+class Stopwatch:
+    def __init__(self):
+        self.stages = {}
+        self.cpu = {}
+        self.last = time.perf_counter()
+        self.last_cpu = time.thread_time()
+
+    def lap(self, stage) -> None:
+        now = time.perf_counter()
+        now_cpu = time.thread_time()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self.last
+        self.cpu[stage] = self.cpu.get(stage, 0) + now_cpu - self.last_cpu
+        self.last = now
+        self.last_cpu = now_cpu
+
+    def send(self, file, rows=0, nbytes=0) -> None:
+        # sends the time collected since the last report
+        report(file, rows, nbytes, self.stages, self.cpu)
+        self.stages = {}
+        self.cpu = {}
+
+    def report(self, file, rows=0, nbytes=0) -> None:
+        self.send(file, rows, nbytes)
+        check_cancelled()
+
+
+class Job:
+    def __init__(self, backend='threads', on_progress=None):
+        if backend == 'processes':
+            context = get_context('spawn')
+            self.queue = context.Queue()
+            self.cancel_event = context.Event()
+        else:
+            self.queue = None
+            self.cancel_event = threading.Event()
+        self.on_progress = on_progress
+        self.lock = threading.Lock()
+        self.files = {}
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.cpu = dict.fromkeys(STAGES, 0.0)
+        # per file (wall, cpu) stage times and peak memory, used by the profiling report
+        self.timings = {}
+        self.peak_rss = {}
+        self.finished_tasks = 0
+        # filled by run_tasks: tasks waiting, tasks running, workers, estimated memory in use, memory budget
+        self.scheduling = None
+        self.peak_scheduling = {'running': 0, 'memory': 0}
+        self.started = datetime.datetime.now()
+        self.start = time.perf_counter()
+
+    @property
+    def messages(self):
+        # worker processes send to the queue, threads update the job directly
+        return self.queue if self.queue is not None else self
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    def connect(self) -> None:
+        connect(self, self.cancel_event)
+
+    def put(self, message) -> None:
+        if message is None:
+            # worker threads finish at the same time, drain() reads the count in another thread
+            with self.lock:
+                self.finished_tasks += 1
+            return
+        file, rows, nbytes, stages, cpu, rss = message
+        with self.lock:
+            counters = self.files.setdefault(file, [0, 0])
+            counters[0] += rows
+            counters[1] += nbytes
+            file_stages, file_cpu = self.timings.setdefault(file, ({}, {}))
+            for stage, seconds in stages.items():
+                self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+                file_stages[stage] = file_stages.get(stage, 0.0) + seconds
+            for stage, seconds in cpu.items():
+                self.cpu[stage] = self.cpu.get(stage, 0.0) + seconds
+                file_cpu[stage] = file_cpu.get(stage, 0.0) + seconds
+            self.peak_rss[file] = max(self.peak_rss.get(file, 0), rss)
+        if self.on_progress is not None:
+            self.on_progress(self.status(file))
+
+    def poll(self) -> None:
+        while self.queue is not None:
+            try:
+                message = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.put(message)
+
+    def schedule(self, queued, running, workers, memory, budget) -> None:
+        self.scheduling = (queued, running, workers, memory, budget)
+        self.peak_scheduling['running'] = max(self.peak_scheduling['running'], running)
+        self.peak_scheduling['memory'] = max(self.peak_scheduling['memory'], memory)
+
+    def drain(self, tasks, timeout=5.0) -> None:
+        # results of worker processes can arrive before their last progress messages
+        deadline = time.perf_counter() + timeout
+        while self.queue is not None and self.finished_tasks < tasks:
+            try:
+                message = self.queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            self.put(message)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def rows(self) -> int:
+        return sum(rows for rows, _ in self.files.values())
+
+    def status(self, file) -> str:
+        rows, nbytes = self.files.get(file, (0, 0))
+        rate = self.rows() / max(self.elapsed(), 1e-9)
+        text = f'{os.path.basename(file)}: {format_number(rows)} строк, {nbytes / 1024 ** 2:.0f} МБ; всего {format_number(rate)} строк/с'
+        if self.scheduling is not None and self.scheduling[1]:
+            queued, running, workers, memory, budget = self.scheduling
+            text += f'; задач {running}/{workers}, в очереди {queued}, память {memory / 1024 ** 3:.1f}/{budget / 1024 ** 3:.1f} ГБ'
+        return text
+
+    def summary(self) -> str:
+        stages = ', '.join(f'{STAGES.get(stage, stage)} {seconds:.1f} с' for stage, seconds in self.stages.items() if seconds)
+        rate = self.rows() / max(self.elapsed(), 1e-9)
+        text = f'{format_number(self.rows())} строк за {self.elapsed():.1f} с ({format_number(rate)} строк/с)'
+        return f'{text}; {stages}' if stages else text
+
+
+def format_number(value) -> str:
+    return f'{value:,.0f}'.replace(',', ' ')
+
+
+def remove_files(*files) -> None:
+    for file in files:
+        try:
+            os.remove(file)
+        except OSError:
+            pass
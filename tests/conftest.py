@@ -0,0 +1,17 @@
+import os
+import sys
+from collections import OrderedDict
+
+# the modules are run from the repository root, not installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    # the data cache is on by default, tests must not fill the one in the home directory or share parsed tables
+    monkeypatch.setenv('MMTT_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(cache, '_memory', OrderedDict())
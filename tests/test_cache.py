@@ -0,0 +1,54 @@
+import gzip
+import hashlib
+import os
+
+import numpy as np
+
+import cache
+from cache import cached_lines, content_key, load_factor, load_table, load_tables
+from constants import CONSTANTS
+from fileio import read_array
+
+
+def test_load_table_parses_compressed_input_once(tmp_path, monkeypatch):
+    monkeypatch.setenv('MMTT_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setenv('MMTT_CACHE_SIZE', str(1 << 30))
+    table = np.arange(40, dtype=np.float64).reshape(10, 4) / 8
+    text = 'Pressure\tX\tY\tZ\n' + ''.join('%r\t%r\t%r\t%r\n\n' % tuple(row) for row in table.tolist())
+    file = str(tmp_path / '1_mean.csv.gz')
+    with gzip.open(file, 'wt', newline='') as f:
+        f.write(text)
+
+    # the key is taken from the compressed bytes, blank lines are not counted as rows
+    with open(file, 'rb') as f:
+        assert content_key(file) == hashlib.blake2b(f.read(), digest_size=20).hexdigest()
+    assert np.array_equal(load_table(file), table)
+    assert np.array_equal(load_table(file), table)
+    # the coordinates are kept as the input text, for text outputs
+    assert cached_lines(load_tables(file)[1], 2, 5) == ['%r %r %r' % tuple(row[1:]) for row in table[2:5].tolist()]
+
+
+def test_tables_stay_in_memory_while_the_disk_cache_is_off(tmp_path, monkeypatch):
+    monkeypatch.setenv('MMTT_CACHE_SIZE', '0')
+    table = np.random.default_rng(0).normal(size=(1000, 4))
+    files = [str(tmp_path / f'{i}_mean.csv') for i in range(2)]
+    for i, file in enumerate(files):
+        np.savetxt(file, table + i, delimiter='\t', header='Pressure\tX\tY\tZ', comments='')
+    first, text = load_tables(files[0])
+    factor = load_factor(files[0], first, 3, 120.0, 40.0, 0.15, 0.76)
+    assert np.array_equal(first, read_array(files[0]))
+    assert cached_lines(text, 0, 1) == [' '.join('%.18e' % value for value in table[0, 1:])]
+
+    # a second run takes the table, the text and the factor from memory without parsing
+    parse = cache.iter_parsed
+    monkeypatch.setattr(cache, 'iter_parsed', None)
+    assert load_tables(files[0])[0] is first and load_tables(files[0])[1] is text
+    assert load_factor(files[0], first, 3, 120.0, 40.0, 0.15, 0.76) is factor
+    assert not os.path.exists(tmp_path / 'cache' / f'{content_key(files[0])}.f8')
+
+    # room for one file: the next one replaces the table and the text of the first
+    monkeypatch.setattr(cache, 'iter_parsed', parse)
+    monkeypatch.setattr(CONSTANTS, 'MEMORY_CACHE_SIZE', int(1.5 * (first.nbytes + text[0].nbytes + text[1].nbytes)))
+    load_tables(files[1])
+    assert [key for key in cache._memory if key[0] != 'factor'] == [('table', content_key(files[1])), ('text', content_key(files[1]))]
+    assert sum(size for _, size in cache._memory.values()) <= CONSTANTS.MEMORY_CACHE_SIZE
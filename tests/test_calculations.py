@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+import pytest
+
+import calculations
+from calculations import envelope_files_sorted, merge_runs, plan_parts, process_file_sweep, process_files_puls, process_files_sweep, sort_rows
+from coefficients import sweep_scenarios
+from constants import CONSTANTS
+from engine import calculate_pik
+
+
+def write_export(file_name, rows=20000, seed=1):
+    # a STAR-CCM+ export with the coordinates in the 1.234560E+01 notation, which repr() would not reproduce
+    rng = np.random.default_rng(seed)
+    table = np.column_stack((rng.normal(-300, 150, rows), rng.uniform(-50, 50, (rows, 2)), rng.uniform(0.5, 120, rows)))
+    with open(file_name, 'w', newline='') as f:
+        f.write('Mean of Pressure (Pa)\tX(m)\tY(m)\tZ(m)\n')
+        f.writelines('%.6E\t%.6E\t%.6E\t%.6E\n' % tuple(row) for row in table.tolist())
+
+
+def run_puls(file, save_dir, workers, output_format):
+    os.makedirs(save_dir)
+    [(_, output, _)] = process_files_puls([file], 120.0, 40.0, 3, 1.2, 0.85, CONSTANTS.AREA_TYPES['B'], str(save_dir), 'threads', workers, output_format=output_format)
+    return output
+
+
+def read_output(file_name):
+    if file_name.endswith('.npz'):
+        # the zip members carry timestamps, so the columns are compared instead of the bytes
+        with np.load(file_name) as data:
+            return {name: data[name].tobytes() for name in data.files}
+    with open(file_name, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'npz'])
+def test_split_run_matches_whole_file(tmp_path, monkeypatch, output_format):
+    file = str(tmp_path / '1_mean.csv')
+    write_export(file)
+    monkeypatch.setenv('MMTT_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setenv('MMTT_CACHE_SIZE', '0')
+    expected = read_output(run_puls(file, tmp_path / 'whole', 1, output_format))
+
+    monkeypatch.setattr(CONSTANTS, 'SPLIT_SIZE', 256 * 1024)
+    outputs = {'split': run_puls(file, tmp_path / 'split', 4, output_format)}
+    # the first run with the cache on splits by bytes and fills the cache, the next ones split by rows,
+    # text outputs copy the coordinates from the cached text
+    monkeypatch.setenv('MMTT_CACHE_SIZE', str(1 << 30))
+    assert [kind for kind, _, _ in plan_parts(file, 4, output_format)] == ['bytes'] * 4
+    outputs['split, cold cache'] = run_puls(file, tmp_path / 'cold', 4, output_format)
+    assert [kind for kind, _, _ in plan_parts(file, 4, output_format)] == ['rows'] * 4
+    outputs['split, warm cache'] = run_puls(file, tmp_path / 'warm', 4, output_format)
+    outputs['whole, warm cache'] = run_puls(file, tmp_path / 'whole-warm', 1, output_format)
+
+    for name, output in outputs.items():
+        assert read_output(output) == expected, name
+    assert sorted(name.rsplit('.', 1)[1] for name in os.listdir(tmp_path / 'cache') if '.' in name) == ['f8', 'npy', 'txt']
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'npz', 'parquet'])
+def test_sweep_output_does_not_depend_on_cache(tmp_path, monkeypatch, output_format):
+    if output_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    file = str(tmp_path / '1_mean.csv')
+    write_export(file, rows=5000)
+    scenarios = sweep_scenarios(120.0, ['A', 'B'], ['2 (СПб)'], ['0.3'], 0.45)
+    monkeypatch.setenv('MMTT_CACHE_DIR', str(tmp_path / 'cache'))
+    outputs = {}
+    for cache in ('off', 'cold', 'warm'):
+        monkeypatch.setenv('MMTT_CACHE_SIZE', '0' if cache == 'off' else str(1 << 30))
+        outputs[cache] = process_file_sweep(file, 120.0, 40.0, 3, scenarios, 0.85, str(tmp_path / cache), output_format=output_format)
+    for cache in ('cold', 'warm'):
+        for output, expected in zip(outputs[cache], outputs['off']):
+            assert read_output(output) == read_output(expected), cache
+
+
+def test_columnar_output_matches_csv(tmp_path, monkeypatch):
+    file = str(tmp_path / '1_mean.csv')
+    write_export(file, rows=5000)
+    monkeypatch.setenv('MMTT_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setenv('MMTT_CACHE_SIZE', str(1 << 30))
+    csv_output = run_puls(file, tmp_path / 'csv', 1, 'csv')
+    npz_output = run_puls(file, tmp_path / 'npz', 1, 'npz')
+    expected = np.loadtxt(csv_output, skiprows=1)
+    with np.load(npz_output) as data:
+        assert np.array_equal(np.column_stack([data[name] for name in data.files]), expected)
+
+
+def test_external_sort_matches_lexsort(tmp_path, monkeypatch):
+    # few distinct coordinates and pressures, so equal keys fall into different runs and merge batches
+    rng = np.random.default_rng(2)
+    table = np.column_stack((rng.integers(-3, 3, 60000), rng.integers(0, 4, (60000, 3)))).astype(np.float64)
+    file = str(tmp_path / '1_max.csv')
+    with open(file, 'w', newline='') as f:
+        f.write('Max of Pressure (Pa)\tX(m)\tY(m)\tZ(m)\n')
+        f.writelines('%r\t%r\t%r\t%r\n' % tuple(row) for row in table.tolist())
+    # 20 runs of 3000 rows, merged in batches of at most 1000 rows from each run
+    monkeypatch.setattr(CONSTANTS, 'SORT_MEMORY', 256 * 3000)
+    batches = []
+    original = merge_runs
+
+    def counted(runs, watch):
+        assert len(runs) == 20
+        for batch in original(runs, watch):
+            batches.append(len(batch))
+            yield batch
+
+    monkeypatch.setattr(calculations, 'merge_runs', counted)
+    spill = str(tmp_path / 'sorted.f8')
+    assert sort_rows(file, spill) == spill
+    assert len(batches) > 1 and sum(batches) == len(table)
+    expected = table[np.lexsort((table[:, 3], table[:, 2], table[:, 1]))]
+    assert np.array_equal(np.fromfile(spill).reshape(-1, 4), expected)
+
+
+@pytest.mark.parametrize('on_disk', [False, True])
+@pytest.mark.parametrize('processing_type', ['max', 'min'])
+def test_sorted_envelope_ties_do_not_depend_on_arrival(tmp_path, monkeypatch, processing_type, on_disk):
+    # the files are not on one mesh, so rows with equal pressures differ in their coordinates
+    # and only the tie-break decides which file's row is written
+    opened = []
+    if on_disk:
+        # the files are sorted externally and the envelope is folded chunk by chunk on disk
+        monkeypatch.setattr(CONSTANTS, 'SORT_MEMORY', 64 * 1024)
+        monkeypatch.setattr(CONSTANTS, 'CHUNK_ROWS', 300)
+        open_memmap = np.lib.format.open_memmap
+
+        def created(name, mode='r+', *args, **kwargs):
+            if mode == 'w+':
+                opened.append(os.path.basename(name))
+            return open_memmap(name, mode, *args, **kwargs)
+        monkeypatch.setattr(np.lib.format, 'open_memmap', created)
+    rng = np.random.default_rng(3)
+    tables = []
+    files = [str(tmp_path / f'{i}_{processing_type}.csv') for i in range(3)]
+    for i, file in enumerate(files):
+        table = np.column_stack((rng.integers(-2, 2, 2000), rng.integers(0, 50, 2000) + i / 8, rng.uniform(0, 1, (2000, 2)) * (0.5, 100))).astype(np.float64)
+        with open(file, 'w', newline='') as f:
+            f.write('Pressure\tX(m)\tY(m)\tZ(m)\n')
+            f.writelines('%r\t%r\t%r\t%r\n' % tuple(row) for row in table.tolist())
+        tables.append(table[np.lexsort((table[:, 3], table[:, 2], table[:, 1]))])
+
+    # the row-wise max/min of the sorted files, the first file wins ties
+    stacked = np.stack(tables)
+    pick = (np.argmax if processing_type == 'max' else np.argmin)(stacked[:, :, 0], axis=0)
+    expected = stacked[pick, np.arange(stacked.shape[1])]
+    alfa, _, dzeta10 = CONSTANTS.AREA_TYPES['B']
+    expected[:, 0] = calculate_pik(expected[:, 0], expected[:, 3], 3, 120.0, 40.0, 0.85, alfa, dzeta10)
+
+    def run_in(order):
+        def stub(func, tasks, backend, workers, job=None, costs=None, on_result=None):
+            for i in order:
+                on_result(i, func(*tasks[i]))
+        return stub
+
+    outputs = []
+    for name, order in (('in-order', [0, 1, 2]), ('reversed', [2, 1, 0]), ('mixed', [1, 2, 0])):
+        monkeypatch.setattr(calculations, 'run_tasks', run_in(order))
+        save_dir = tmp_path / name
+        os.makedirs(save_dir)
+        output = envelope_files_sorted(files, processing_type, 120.0, 40.0, 3, 0.85, CONSTANTS.AREA_TYPES['B'], str(save_dir), 'threads', 1)
+        outputs.append(read_output(output))
+        assert np.array_equal(np.loadtxt(output, skiprows=1), expected), name
+    assert outputs[1] == outputs[0] and outputs[2] == outputs[0]
+    assert opened == (['envelope.npy', 'owner.npy'] * 3 if on_disk else [])
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'npz'])
+@pytest.mark.parametrize('index', [1, 3])
+def test_sweep_matches_separate_runs(tmp_path, monkeypatch, output_format, index):
+    # every scenario of a sweep is the output of a separate run with its area data and dynamic coefficient
+    files = [str(tmp_path / f'{i}_mean.csv') for i in range(2)]
+    for i, file in enumerate(files):
+        write_export(file, rows=5000, seed=i)
+    monkeypatch.setenv('MMTT_CACHE_DIR', str(tmp_path / 'cache'))
+    scenarios = sweep_scenarios(120.0, ['A', 'B'], ['2 (СПб)', '300'], ['0.15', '0.3'], 0.45)
+    assert len({dynamic for _, _, dynamic in scenarios}) > 2
+    [(_, outputs, _), (_, more_outputs, _)] = process_files_sweep(files, 120.0, 40.0, index, scenarios, 0.85, str(tmp_path / 'sweep'), 'threads', 2, output_format=output_format)
+    assert len(outputs) == len(scenarios)
+    for (name, area_data, dynamic), output, more_output in zip(scenarios, outputs, more_outputs):
+        save_dir = tmp_path / 'separate' / name
+        os.makedirs(save_dir)
+        separate = process_files_puls(files, 120.0, 40.0, index, dynamic, 0.85, area_data, str(save_dir), 'threads', 2, output_format=output_format)
+        assert read_output(output) == read_output(separate[0][1]), name
+        assert read_output(more_output) == read_output(separate[1][1]), name
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from calculations import process_row_puls
+from constants import CONSTANTS
+from engine import RunningStats, calculate_puls, gumbel_peak
+
+
+@pytest.mark.parametrize('index', [1, 2, 3])
+def test_calculate_puls_matches_row_reference(index):
+    # heights below the width, between the width and height - width and above it cover every branch
+    rng = np.random.default_rng(index)
+    height_building, width_building = 120.0, 40.0
+    pressure = rng.normal(-300, 150, 1000)
+    Z = rng.uniform(0.5, height_building, 1000)
+    Z[:3] = (width_building, height_building - width_building, 10.0)
+    alfa, _, dzeta10 = CONSTANTS.AREA_TYPES['B']
+    dynamic, coef_corr = 1.37, 0.85
+
+    result = calculate_puls(pressure, Z, index, height_building, width_building, dynamic, coef_corr, alfa, dzeta10)
+
+    expected = [
+        float(process_row_puls([repr(p), '0', '0', repr(z)], index, height_building, width_building, dynamic, coef_corr, alfa, dzeta10)[0])
+        for p, z in zip(pressure.tolist(), Z.tolist())
+    ]
+    assert result.tolist() == expected
+
+
+def test_running_stats_match_the_stacked_snapshots():
+    # 1003 points in blocks of 256 and 23 snapshots in 4 epochs: neither divides evenly
+    rng = np.random.default_rng(5)
+    snapshots = rng.normal(-200, 80, (23, 1003))
+    stats = RunningStats(1003, steps=23, epochs=4, block=256)
+    for snapshot in snapshots:
+        stats.add(snapshot)
+
+    assert np.allclose(stats.mean, np.mean(snapshots, axis=0), rtol=0, atol=1e-10)
+    assert np.allclose(stats.std(), np.std(snapshots, axis=0, ddof=0), rtol=1e-12, atol=1e-10)
+    assert np.array_equal(stats.max, snapshots.max(axis=0))
+    assert np.array_equal(stats.min, snapshots.min(axis=0))
+    epoch = np.arange(23) * 4 // 23
+    assert np.bincount(epoch).tolist() == [6, 6, 6, 5]
+    for e in range(4):
+        assert np.array_equal(stats.epoch_max[e], snapshots[epoch == e].max(axis=0))
+        assert np.array_equal(stats.epoch_min[e], snapshots[epoch == e].min(axis=0))
+
+
+def test_running_stats_reject_wrong_snapshots():
+    stats = RunningStats(3, steps=2, epochs=2)
+    with pytest.raises(ValueError):
+        stats.add(np.zeros(4))
+    stats.add(np.zeros(3))
+    stats.add(np.ones(3))
+    with pytest.raises(ValueError):
+        stats.add(np.ones(3))
+    with pytest.raises(ValueError):
+        RunningStats(3, steps=5, epochs=6)
+
+
+def test_gumbel_peak_matches_the_analytic_quantile():
+    location, scale, fractile = 10.0, 2.0, 0.78
+    maxima = np.random.default_rng(6).gumbel(location, scale, (5000, 20))
+    expected = location - scale * np.log(-np.log(fractile))
+    assert np.allclose(gumbel_peak(maxima, fractile), expected, rtol=0.02)
+    # the min peak is fitted to the negated minima
+    stats = RunningStats(20, steps=5000, epochs=5000)
+    for snapshot in -maxima:
+        stats.add(snapshot)
+    assert np.allclose(stats.peaks(fractile)[1], -expected, rtol=0.02)
+
+
+def test_gumbel_peak_of_equal_maxima_is_their_value():
+    maxima = np.full((10, 4), -123.5)
+    assert np.allclose(gumbel_peak(maxima, 0.78), -123.5, rtol=0, atol=1e-9)
+    assert np.isfinite(gumbel_peak(maxima, 0.78)).all()
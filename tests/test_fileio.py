@@ -0,0 +1,43 @@
+import gzip
+
+import numpy as np
+import pytest
+
+from fileio import iter_tables, parse_block, read_array, split_file
+
+
+def test_parse_block_skips_blank_lines():
+    assert parse_block(b'1 2\n\n  3\t4  \n\t\n5 6').tolist() == [[1, 2], [3, 4], [5, 6]]
+    assert parse_block(b'\n \n').shape == (0, 0)
+
+
+def test_parse_block_rejects_a_short_line():
+    # 4 + 3 + 5 numbers would reshape into two rows of 4 without the per-line check
+    with pytest.raises(ValueError, match='Line 3: expected 4 numbers, found 3'):
+        parse_block(b'1\t2\t3\t4\n5\t6\t7\n8\t9\t10\t11\t12\n', line=2)
+
+
+@pytest.mark.parametrize('suffix', ['.csv', '.csv.gz'])
+def test_short_line_is_reported_with_its_line_number(tmp_path, suffix):
+    file = str(tmp_path / f'1_mean{suffix}')
+    text = 'Pressure\tX\tY\tZ\n' + '1.0\t2.0\t3.0\t4.0\n' * 1000 + '1.0\t2.0\t3.0\n' + '1.0\t2.0\t3.0\t4.0\n' * 10
+    with (gzip.open if suffix.endswith('.gz') else open)(file, 'wt', newline='') as f:
+        f.write(text)
+
+    with pytest.raises(ValueError, match='Line 1002:'):
+        read_array(file)
+    if suffix == '.csv':
+        # a byte range in the middle of the file counts the lines before it
+        with pytest.raises(ValueError, match='Line 1002:'):
+            for start, end in split_file(file, 3):
+                list(iter_tables(file, start, end, block_size=1 << 10))
+    else:
+        with pytest.raises(ValueError, match='Line 1002:'):
+            list(iter_tables(file, block_size=1 << 10))
+
+
+def test_read_array_matches_loadtxt(tmp_path):
+    file = str(tmp_path / '1_mean.csv')
+    table = np.random.default_rng(1).normal(size=(5000, 4))
+    np.savetxt(file, table, delimiter='\t', header='Pressure\tX\tY\tZ', comments='')
+    assert np.array_equal(read_array(file), np.loadtxt(file, skiprows=1))
@@ -0,0 +1,97 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import mesh
+from calculations import envelope_files_keyed, sort_rows
+from constants import CONSTANTS
+from engine import calculate_pik
+from fileio import read_array
+
+
+def write_snapshot(file_name, xyz, seed):
+    pressure = np.random.default_rng(seed).normal(-300, 150, len(xyz))
+    with open(file_name, 'w', newline='') as f:
+        f.write('Pressure (Pa)\tX(m)\tY(m)\tZ(m)\n')
+        f.writelines('%.6E\t%.6E\t%.6E\t%.6E\n' % row for row in zip(pressure.tolist(), *xyz.T.tolist()))
+
+
+def test_mesh_is_parsed_once_and_reused(tmp_path, monkeypatch):
+    monkeypatch.setattr(mesh, '_meshes', OrderedDict())
+    xyz = np.random.default_rng(0).uniform(-50, 50, (5000, 3))
+    files = [str(tmp_path / f'p_{i}.csv') for i in range(3)]
+    for i, file in enumerate(files[:2]):
+        write_snapshot(file, xyz, i)
+    write_snapshot(files[2], xyz[::-1], 2)
+
+    pressure, first = mesh.read_with_mesh(files[0])
+    table = read_array(files[0])
+    assert np.array_equal(pressure, table[:, 0])
+    assert np.array_equal(first.xyz, table[:, 1:])
+    assert np.array_equal(first.order, np.lexsort((table[:, 3], table[:, 2], table[:, 1])))
+
+    # the same points with other pressures: the coordinates are only hashed, the mesh comes from memory or disk
+    _, fingerprint, parsed = mesh._scan(files[1], True)
+    assert fingerprint == first.fingerprint and parsed is None
+    monkeypatch.setattr(mesh, '_meshes', OrderedDict())
+    pressure, second = mesh.read_with_mesh(files[1])
+    assert np.array_equal(pressure, read_array(files[1])[:, 0])
+    assert np.array_equal(second.xyz, first.xyz)
+
+    # another order of the points is another mesh
+    _, reordered = mesh.read_with_mesh(files[2])
+    assert reordered.fingerprint != first.fingerprint
+    assert np.array_equal(reordered.xyz, read_array(files[2])[:, 1:])
+
+
+def test_meshes_are_bounded_in_memory_and_on_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(mesh, '_meshes', OrderedDict())
+    monkeypatch.setattr(CONSTANTS, 'MESH_MEMORY', 2)
+    rng = np.random.default_rng(0)
+    files = [str(tmp_path / f'p_{i}.csv') for i in range(4)]
+    for i, file in enumerate(files):
+        write_snapshot(file, rng.uniform(-50, 50, (1000, 3)), i)
+    # room for about two meshes of 1000 points on disk
+    monkeypatch.setattr(CONSTANTS, 'MESH_CACHE_SIZE', 80000)
+
+    meshes = [mesh.read_with_mesh(file)[1] for file in files]
+    assert list(mesh._meshes) == [meshes[2].fingerprint, meshes[3].fingerprint]
+    stored = sorted(os.listdir(tmp_path / CONSTANTS.MESH_CACHE_DIR))
+    assert stored == sorted(f'{m.fingerprint}.npz' for m in meshes[2:])
+
+
+def test_sort_follows_the_mesh_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(mesh, '_meshes', OrderedDict())
+    # repeated points keep their file order, as a stable sort of the coordinates does
+    xyz = np.random.default_rng(0).integers(0, 5, (3000, 3)).astype(np.float64)
+    files = [str(tmp_path / f'p_{i}.csv') for i in range(2)]
+    for i, file in enumerate(files):
+        write_snapshot(file, xyz, i)
+    for file in files:
+        expected = read_array(file)
+        expected = expected[np.lexsort((expected[:, 3], expected[:, 2], expected[:, 1]))]
+        assert np.array_equal(sort_rows(file, None), expected)
+
+
+def test_points_match_across_a_cell_boundary():
+    tolerance = 1e-6
+    xyz = np.array([[0.5e-6 - 5e-10, 1.0, 2.0], [10.0, 10.0, 10.0], [20.0, 20.0, 20.0]])
+    query = np.array([[0.5e-6 + 5e-10, 1.0, 2.0], [10.0 + 0.9e-6, 10.0 - 0.9e-6, 10.0], [20.0 + 1.5e-6, 20.0, 20.0], [10.0, 10.0, 10.0]])
+    assert mesh.PointIndex(xyz, tolerance).lookup(query).tolist() == [0, 1, -1, 1]
+
+
+def test_keyed_envelope_keeps_the_extreme_of_repeated_points(tmp_path, monkeypatch):
+    monkeypatch.setattr(mesh, '_meshes', OrderedDict())
+    files = [str(tmp_path / f'{i}_max.csv') for i in range(2)]
+    with open(files[0], 'w') as f:
+        f.write('P\tX\tY\tZ\n1.0\t0.0\t0.0\t10.0\n2.0\t1.0\t0.0\t10.0\n')
+    # the first point appears twice in the second file, the larger value must win whatever its position
+    with open(files[1], 'w') as f:
+        f.write('P\tX\tY\tZ\n1.0\t1.0\t0.0\t10.0\n5.0\t0.0\t0.0\t10.0\n3.0\t0.0\t0.0\t10.0\n')
+    missing = envelope_files_keyed(files, 'max', 120.0, 40.0, 3, 1.0, CONSTANTS.AREA_TYPES['B'], str(tmp_path))
+    assert missing == 0
+    with open(tmp_path / 'max.csv') as f:
+        result = np.loadtxt(f, skiprows=1)
+    expected = calculate_pik(np.array([5.0, 2.0]), result[:, 3], 3, 120.0, 40.0, 1.0, *CONSTANTS.AREA_TYPES['B'][::2])
+    assert np.array_equal(result[:, 0], expected)
@@ -0,0 +1,43 @@
+import threading
+import time
+
+from parallel import run_tasks
+
+running = {}
+peaks = []
+lock = threading.Lock()
+
+
+def record(name, memory):
+    # the tasks running together with this one and their memory, as seen when it starts
+    with lock:
+        running[name] = memory
+        peaks.append(dict(running))
+    time.sleep(0.05)
+    with lock:
+        del running[name]
+    return name
+
+
+def test_tasks_fit_into_the_memory_budget(monkeypatch):
+    monkeypatch.setenv('MMTT_MEMORY_BUDGET', '100')
+    peaks.clear()
+    memory = {'a': 60, 'b': 50, 'c': 40, 'd': 30, 'e': 20, 'f': 10}
+    tasks = [(name, cost) for name, cost in memory.items()]
+    results = run_tasks(record, tasks, 'threads', 4, costs=[(cost, 1) for cost in memory.values()])
+    assert results == list(memory)
+    assert all(sum(together.values()) <= 100 for together in peaks)
+    # the budget was used: tasks did run side by side
+    assert max(len(together) for together in peaks) > 1
+
+
+def test_task_larger_than_the_budget_runs_alone(monkeypatch):
+    monkeypatch.setenv('MMTT_MEMORY_BUDGET', '100')
+    peaks.clear()
+    memory = {'small': 30, 'huge': 250, 'other': 40, 'last': 20}
+    tasks = [(name, cost) for name, cost in memory.items()]
+    results = run_tasks(record, tasks, 'threads', 4, costs=[(cost, 1) for cost in memory.values()])
+    assert results == list(memory)
+    # the huge task is started first as the longest and nothing else starts until it is done
+    assert [together for together in peaks if 'huge' in together] == [{'huge': 250}]
+    assert all(sum(together.values()) <= 100 for together in peaks if 'huge' not in together)